@@ -0,0 +1,227 @@
+'''
+CORPUS.PY
+
+This script holds a training set as one compact piano roll.
+Every song's frames are stacked end to end, bit-packed (one bit per note flag, so 8 note flags per byte),
+with an index of where each song starts. Frames are only expanded to float32 a minibatch at a time, as they're
+handed to the network.
+
+A corpus can also live in a file (see CorpusWriter), which is memory-mapped rather than read in - only the frames
+a minibatch actually touches are paged in, so the training set doesn't have to fit in memory.
+
+DEPENDENCIES:
+
+Numpy - math library (and bit-packing).
+JSON/Struct - corpus file header.
+OS - file utilities.
+'''
+
+import json
+import numpy as num
+import os
+import struct
+
+CORPUS_EXT = '.nnc'
+
+#Corpus file layout: magic, header length (little-endian uint32) and JSON header, padded out to CORPUS_HEADER_BYTES.
+#Then the packed frames, and finally the song offsets (little-endian int64) on a 64 byte boundary.
+#The header is written last, once the frame count is known.
+CORPUS_MAGIC = b'NNCORP01'
+CORPUS_HEADER_BYTES = 4096
+CORPUS_ALIGN = 64
+
+#Shift every note in a batch of windows (n x timesteps x width, [held | articulated]) by a number of semitones,
+#one shift per window. Both halves move together. Notes pushed past either end of the note range are dropped,
+#just as MIDItoFV drops notes outside lowBound/highBound.
+def Transpose(rows, shifts):
+    notespan = rows.shape[-1] // 2
+    halves = num.reshape(rows, rows.shape[:-1] + (2, notespan))
+    shifted = num.zeros_like(halves)
+
+    for shift in num.unique(shifts):
+        chosen = shifts == shift
+
+        if shift == 0:
+            shifted[chosen] = halves[chosen]
+        elif shift > 0:
+            shifted[chosen, ..., shift:] = halves[chosen, ..., :-shift]
+        else:
+            shifted[chosen, ..., :shift] = halves[chosen, ..., -shift:]
+
+    return num.reshape(shifted, rows.shape)
+
+'''
+Corpus class.
+Packed frames live in "frames" (one row of packed bytes per frame), and song i spans rows offsets[i] to offsets[i + 1].
+Iterating over a corpus gives back each song unpacked, as a uint8 array of frames.
+'''
+class Corpus:
+
+    def __init__(self, width, frames=None, offsets=None, filename=None):
+
+        #Note flags per frame (held + articulated halves), and bytes per frame once packed.
+        self.width = width
+        self.packedWidth = -(-width // 8)
+
+        self.frames = frames if frames is not None else num.zeros((0, self.packedWidth), num.uint8)
+        self.offsets = offsets if offsets is not None else num.zeros(1, num.int64)
+
+        #Set when the frames are memory-mapped from a corpus file.
+        self.filename = filename
+
+    #Pack a sequence of songs (frames x width arrays of 0/1) into a corpus.
+    @staticmethod
+    def FromSongs(songs, width):
+        packed = [num.packbits(num.asarray(song, num.uint8), axis=1) for song in songs]
+
+        if not packed:
+            return Corpus(width)
+
+        offsets = num.zeros(len(packed) + 1, num.int64)
+        offsets[1:] = num.cumsum([len(song) for song in packed])
+
+        return Corpus(width, num.concatenate(packed), offsets)
+
+    #Map a corpus file. The song index is read in, but frames stay on disk until they're used.
+    @staticmethod
+    def Open(filename):
+        with open(filename, 'rb') as corpusFile:
+            if corpusFile.read(len(CORPUS_MAGIC)) != CORPUS_MAGIC:
+                raise ValueError(filename + " is not a corpus file")
+
+            headerLen, = struct.unpack('<I', corpusFile.read(4))
+            header = json.loads(corpusFile.read(headerLen).decode())
+
+        offsets = num.fromfile(filename, num.dtype('<i8'), header["songs"] + 1, offset=header["offsetsAt"])
+        frameShape = (header["frames"], -(-header["width"] // 8))
+
+        #An empty map isn't allowed, but then there's nothing to map.
+        if header["frames"] > 0:
+            frames = num.memmap(filename, num.uint8, 'r', CORPUS_HEADER_BYTES, frameShape)
+        else:
+            frames = num.zeros(frameShape, num.uint8)
+
+        return Corpus(header["width"], frames, offsets.astype(num.int64), filename)
+
+    def IsMapped(self):
+        return self.filename is not None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.Song(i)
+
+    def SongLengths(self):
+        return num.diff(self.offsets)
+
+    def Song(self, i):
+        return num.unpackbits(self.frames[self.offsets[i]:self.offsets[i + 1]], axis=1, count=self.width)
+
+    def NumFrames(self):
+        return int(self.offsets[-1])
+
+    def NBytes(self):
+        return self.frames.nbytes + self.offsets.nbytes
+
+    #Frame index of the start of every training window.
+    #A window starts every hop frames within a song (by default, hop = timesteps - back-to-back windows),
+    #and windows never run past the end of their song. Songs shorter than minLength frames are skipped entirely.
+    #Only the start frames are computed, so re-windowing for a different number of timesteps is cheap.
+    def WindowStarts(self, timesteps, minLength=0, hop=None):
+        if hop is not None and hop < 0:
+            raise ValueError("Window hop can't be negative, got {}".format(hop))
+
+        hop = hop or timesteps
+        lengths = self.SongLengths()
+        counts = num.where((lengths >= minLength) & (lengths >= timesteps), (lengths - timesteps) // hop + 1, 0)
+        songIdx = num.repeat(num.arange(len(self)), counts)
+        windowIdx = num.arange(counts.sum()) - num.repeat(num.cumsum(counts) - counts, counts)
+
+        return self.offsets[songIdx] + windowIdx * hop
+
+    #Every timesteps-long window of packed frames, as a read-only view - row i is the window starting at frame i.
+    #Consecutive windows share all but one frame of memory, so this costs nothing however much they overlap.
+    def WindowView(self, timesteps):
+        rowStride, byteStride = self.frames.strides
+        shape = (max(len(self.frames) - timesteps + 1, 0), timesteps, self.packedWidth)
+
+        return num.lib.stride_tricks.as_strided(self.frames, shape, (rowStride, rowStride, byteStride),
+                                                writeable=False)
+
+    #Expand the windows starting at the given frames into visible layer rows (one window per row).
+    #Only the chosen windows are copied out of the view, and unpacked.
+    #Each window can be transposed by the matching number of semitones in shifts.
+    def Windows(self, starts, timesteps, dtype=num.float32, shifts=None):
+        packedRows = self.WindowView(timesteps)[num.asarray(starts)]
+        rows = num.unpackbits(packedRows, axis=-1, count=self.width)
+
+        if shifts is not None:
+            rows = Transpose(rows, shifts)
+
+        return num.reshape(rows, (len(starts), timesteps * self.width)).astype(dtype)
+
+    #One epoch of minibatches - every window (from WindowStarts) once, in a random order.
+    #Shuffling only touches the window index, and each batch is expanded as it's needed.
+    #With a transpose range, every window is shifted by a random number of semitones (up to that many, either way)
+    #as it's expanded - augmentation that costs no memory, and differs from epoch to epoch.
+    def Batches(self, starts, timesteps, batchSize, rng=None, transposeRange=0):
+        rng = rng if rng is not None else num.random.default_rng()
+        starts = rng.permutation(starts)
+
+        for i in range(0, len(starts), batchSize):
+            batchStarts = starts[i:i + batchSize]
+            shifts = None
+
+            if transposeRange > 0:
+                shifts = rng.integers(-transposeRange, transposeRange + 1, len(batchStarts))
+
+            yield self.Windows(batchStarts, timesteps, shifts=shifts)
+
+'''
+CorpusWriter class.
+Builds a corpus file one song at a time, so songs can be written out as they're parsed and never all held at once.
+The file is written under a temporary name and only swapped in by Close - Abort throws it away.
+'''
+class CorpusWriter:
+
+    def __init__(self, filename, width):
+        self.filename = filename
+        self.width = width
+        self.offsets = [0]
+
+        self.tmpName = "{}.{}.tmp".format(filename, os.getpid())
+        self.corpusFile = open(self.tmpName, 'wb')
+        self.corpusFile.write(bytes(CORPUS_HEADER_BYTES))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def Append(self, song):
+        packed = num.packbits(num.asarray(song, num.uint8), axis=1)
+        self.corpusFile.write(packed.tobytes())
+        self.offsets.append(self.offsets[-1] + len(packed))
+
+    #Finish the file and hand back the corpus, mapped from it.
+    def Close(self):
+        offsetsAt = -(-self.corpusFile.tell() // CORPUS_ALIGN) * CORPUS_ALIGN
+        self.corpusFile.write(bytes(offsetsAt - self.corpusFile.tell()))
+        self.corpusFile.write(num.array(self.offsets, num.dtype('<i8')).tobytes())
+
+        header = json.dumps({"width": self.width, "songs": len(self), "frames": self.offsets[-1],
+                             "offsetsAt": offsetsAt}).encode()
+
+        self.corpusFile.seek(0)
+        self.corpusFile.write(CORPUS_MAGIC + struct.pack('<I', len(header)) + header)
+        self.corpusFile.close()
+
+        os.replace(self.tmpName, self.filename)
+        return Corpus.Open(self.filename)
+
+    def Abort(self):
+        self.corpusFile.close()
+
+        #Close may have got as far as swapping the file in - then there's no temporary file left to remove.
+        if os.path.exists(self.tmpName):
+            os.remove(self.tmpName)
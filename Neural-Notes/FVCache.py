@@ -0,0 +1,161 @@
+'''
+FVCACHE.PY
+
+This script manages an on-disk cache of parsed feature vectors, so unchanged MIDI files skip re-parsing.
+
+DEPENDENCIES:
+
+Msgpack - compact binary serialization.
+Hashlib - content hashing of MIDI files.
+Numpy - math library (and bit-packing).
+OS - directory path/file utilities.
+Profiler - optional timing spans.
+'''
+
+import hashlib
+import msgpack
+import numpy as num
+import os
+
+import MidiWrapper as nn_midi
+from Profiler import Profiled
+
+#Default cache location and size budget.
+FV_CACHE_LOC = os.path.dirname(os.path.realpath(__file__)) + '/data/fv_cache'
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+CACHE_EXT = '.fv'
+
+#Load a single file's feature vector, going through the cache if one is given.
+#Lives at module level so it can be handed to a process pool.
+#Exceptions are handed back rather than raised, so one bad file doesn't sink the whole load.
+@Profiled()
+def LoadFeatureVector(filename, midiUtil, cache=None):
+    try:
+        if cache is not None:
+            return cache.Load(filename, midiUtil), None
+
+        return num.array(midiUtil.MIDItoFV(filename), num.uint8), None
+    except Exception as e:
+        return None, e
+
+class FVCache:
+
+    def __init__(self, cacheDir=FV_CACHE_LOC, maxBytes=DEFAULT_CACHE_BYTES):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+
+    #Build the cache key for a MIDI file.
+    #Covers the file contents plus every setting that changes what MIDItoFV produces.
+    #Editing a file, changing the note range or bumping the parser version all invalidate old entries.
+    @Profiled()
+    def Key(self, filename, midiUtil):
+        fileHash = hashlib.sha1()
+
+        with open(filename, 'rb') as midiFile:
+            for chunk in iter(lambda: midiFile.read(1 << 16), b''):
+                fileHash.update(chunk)
+
+        keyData = "{}:{}:{}:{}:{}".format(fileHash.hexdigest(), midiUtil.lowBound, midiUtil.highBound,
+                                           midiUtil.maxLength, nn_midi.PARSER_VERSION)
+
+        return hashlib.sha1(keyData.encode('utf-8')).hexdigest()
+
+    def EntryPath(self, key):
+        return os.path.join(self.cacheDir, key + CACHE_EXT)
+
+    #Fetch a cached feature vector, or None on a miss.
+    #Hits have their timestamp refreshed so eviction drops the least recently used entries first.
+    @Profiled()
+    def Get(self, key):
+        entryPath = self.EntryPath(key)
+
+        try:
+            with open(entryPath, 'rb') as entryFile:
+                entry = msgpack.unpackb(entryFile.read(), raw=False)
+        except (OSError, ValueError, msgpack.UnpackException):
+            return None
+
+        if entry.get('version') != nn_midi.PARSER_VERSION:
+            return None
+
+        #Feature vectors are binary, so we store them one bit per note flag.
+        rows, cols = entry['shape']
+        fv = num.unpackbits(num.frombuffer(entry['bits'], dtype=num.uint8), count=rows * cols)
+        fv = num.reshape(fv, (rows, cols))
+
+        try:
+            os.utime(entryPath, None)
+        except OSError:
+            pass
+
+        return fv
+
+    @Profiled()
+    def Put(self, key, fv):
+        fv = num.asarray(fv)
+
+        entry = {
+            'version': nn_midi.PARSER_VERSION,
+            'shape': list(fv.shape),
+            'bits': num.packbits(fv.astype(num.uint8).ravel()).tobytes()
+        }
+
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+        #Write to a temporary file first, so an interrupted load can't leave a half-written entry behind.
+        entryPath = self.EntryPath(key)
+        tmpPath = "{}.{}.tmp".format(entryPath, os.getpid())
+
+        with open(tmpPath, 'wb') as entryFile:
+            entryFile.write(msgpack.packb(entry, use_bin_type=True))
+
+        os.replace(tmpPath, entryPath)
+
+    #Grab a file's feature vector from the cache, parsing (and caching) it on a miss.
+    def Load(self, filename, midiUtil):
+        key = self.Key(filename, midiUtil)
+        fv = self.Get(key)
+
+        if fv is None:
+            fv = num.array(midiUtil.MIDItoFV(filename), num.uint8)
+            self.Put(key, fv)
+
+        return fv
+
+    #Trim the cache down to its size budget, dropping the least recently used entries first.
+    @Profiled()
+    def Evict(self):
+        if not os.path.isdir(self.cacheDir):
+            return
+
+        entries = []
+        totalBytes = 0
+
+        for dirEntry in os.scandir(self.cacheDir):
+            if not dirEntry.name.endswith(CACHE_EXT):
+                continue
+
+            stat = dirEntry.stat()
+            entries.append((stat.st_mtime, stat.st_size, dirEntry.path))
+            totalBytes += stat.st_size
+
+        entries.sort()
+
+        for _, size, path in entries:
+            if totalBytes <= self.maxBytes:
+                break
+
+            try:
+                os.remove(path)
+                totalBytes -= size
+            except OSError:
+                pass
+
+    #Throw away every cached entry.
+    def Clear(self):
+        if not os.path.isdir(self.cacheDir):
+            return
+
+        for dirEntry in os.scandir(self.cacheDir):
+            if dirEntry.name.endswith(CACHE_EXT):
+                os.remove(dirEntry.path)
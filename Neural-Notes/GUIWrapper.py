@@ -8,6 +8,8 @@ import tkinter as tk
 from tkinter import filedialog
 from PIL import Image, ImageTk
 import time
+import queue
+import threading
 
 BG_COL = '#000000'
 TXT_COL = '#ffffff'
@@ -34,24 +36,149 @@ def ChooseDirectory(title=""):
 
 '''
 FrameMgr class.
-Lightweight frame timer used to structure our main update loop.
+Lightweight frame timer.
+The main loop is event-driven (Tkinter's mainloop), so this is only used as an optional probe of how
+responsive that loop is - see FRAME_PROBE in NeuralNotes.py.
 '''
 class FrameMgr:
 
     def __init__(self, maxFramerate):
         self.maxFramerate = maxFramerate
         self.targetDelta = 1.0 / maxFramerate
-        self.prevTime = time.clock()
-        self.curTime = time.clock()
+        self.prevTime = time.perf_counter()
+        self.curTime = self.prevTime
         self.delta = 0.0
 
+        #Stats since the last report.
+        self.reportTime = self.curTime
+        self.frameCount = 0
+        self.worstDelta = 0.0
+
     def Tick(self):
-        self.curTime = time.clock()
+        self.curTime = time.perf_counter()
         self.delta = self.curTime - self.prevTime
         self.prevTime = self.curTime
 
+        self.frameCount += 1
+        self.worstDelta = max(self.worstDelta, self.delta)
+
     def TimeSinceTick(self):
-        return time.clock() - self.curTime
+        return time.perf_counter() - self.curTime
+
+    def TimeSinceReport(self):
+        return self.curTime - self.reportTime
+
+    #Summarize frame timing since the last report, then start counting afresh.
+    def Report(self):
+        elapsed = self.TimeSinceReport()
+        avgDelta = elapsed / self.frameCount if self.frameCount > 0 else 0.0
+
+        msg = "{} frames in {:.2f}s (avg {:.1f}ms, worst {:.1f}ms, target {:.1f}ms)".format(
+            self.frameCount, elapsed, avgDelta * 1000, self.worstDelta * 1000, self.targetDelta * 1000)
+
+        self.reportTime = self.curTime
+        self.frameCount = 0
+        self.worstDelta = 0.0
+
+        return msg
+
+#Format a duration in seconds as h:mm:ss (or m:ss).
+def FormatDuration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    if hours > 0:
+        return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+    return "{}:{:02d}".format(minutes, seconds)
+
+'''
+TaskRunner class.
+Runs long jobs (loading, training, generation) on a background thread, so the window keeps responding.
+The job reports progress through Progress, from its own thread; messages are queued up and handed to the UI
+on the main thread by Poll (Tkinter doesn't like being touched from anywhere else).
+Cancelling just sets cancelEvent - jobs are expected to check it and wind down on their own.
+'''
+class TaskRunner:
+
+    def __init__(self):
+        self.messages = queue.Queue()
+        self.cancelEvent = threading.Event()
+        self.thread = None
+        self.statusFn = None
+        self.doneFn = None
+        self.stage = None
+        self.stageStart = 0.0
+
+    def IsBusy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    #Start a job on the background thread.
+    #statusFn gets progress strings, and doneFn gets the job's return value (both called on the main thread).
+    def Start(self, job, statusFn, doneFn):
+        if self.IsBusy():
+            return False
+
+        self.cancelEvent.clear()
+        self.statusFn = statusFn
+        self.doneFn = doneFn
+        self.stage = None
+        self.stageStart = time.perf_counter()
+
+        def RunJob():
+            try:
+                result = job()
+            except Exception as e:
+                print(e)
+                result = False
+
+            self.messages.put(("done", result))
+
+        self.thread = threading.Thread(target=RunJob, daemon=True)
+        self.thread.start()
+        return True
+
+    def Cancel(self):
+        if self.IsBusy():
+            self.cancelEvent.set()
+
+    def IsCancelled(self):
+        return self.cancelEvent.is_set()
+
+    #Called from the job's thread, with how far along the current stage is.
+    #Throughput and ETA are worked out per stage, from when that stage first reported in.
+    def Progress(self, stage, done, total):
+        now = time.perf_counter()
+
+        #The first stage is timed from when the job started, later ones from when the previous stage finished.
+        if stage != self.stage:
+            if self.stage is not None:
+                self.stageStart = now
+
+            self.stage = stage
+
+        elapsed = now - self.stageStart
+        msg = "{}... {}/{}".format(stage, done, total)
+
+        if elapsed > 0 and done > 0:
+            rate = done / elapsed
+            msg += " ({:.1f}/s, ETA {})".format(rate, FormatDuration((total - done) / rate))
+
+        self.messages.put(("progress", msg))
+
+    #Called from the main loop - passes any queued messages on to the UI.
+    def Poll(self):
+        while True:
+            try:
+                kind, data = self.messages.get_nowait()
+            except queue.Empty:
+                return
+
+            if kind == "progress":
+                self.statusFn(data)
+            else:
+                self.thread = None
+                self.doneFn(data)
 
 '''
 AppData class. 
@@ -280,7 +407,13 @@ class MainUI:
         self.tBtnBack.grid(row=row,column=col,sticky="sw",pady=PADDING*2,padx=PADDING*2)
         self.tBtnBack.bind("<ButtonRelease-1>", self.GoMain)
 
-        col += 2
+        col += 1
+        self.tBtnCancel = tk.Button(self.trainContainer,
+                                    text="Cancel")
+        configUIButtonSquare(self.tBtnCancel)
+        self.tBtnCancel.grid(row=row,column=col,sticky="sw",pady=PADDING*2)
+
+        col += 1
         self.trainContainer.grid_columnconfigure(col,weight=1)
         self.tBtnLoadData = tk.Button(self.trainContainer,
                                       text="Load Data")
@@ -379,7 +512,13 @@ class MainUI:
         self.gBtnBack.grid(row=row,column=col,sticky="sw",pady=PADDING*2,padx=PADDING*2)
         self.gBtnBack.bind("<ButtonRelease-1>", self.GoMain)
 
-        col += 2
+        col += 1
+        self.gBtnCancel = tk.Button(self.genContainer,
+                                    text="Cancel")
+        configUIButtonSquare(self.gBtnCancel)
+        self.gBtnCancel.grid(row=row,column=col,sticky="sw",pady=PADDING*2)
+
+        col += 1
         self.genContainer.columnconfigure(col,weight=1)
 
         self.gBtnGen = tk.Button(self.genContainer,
@@ -392,11 +531,11 @@ class MainUI:
     #Updating status messages.
     def SetTrainStatus(self, msg):
         self.tLblStatus.configure(text="STATUS: " + msg)
-        self.tLblStatus.update()
+        self.tLblStatus.update_idletasks()
 
     def SetGenStatus(self, msg):
         self.gLblStatus.configure(text="STATUS: " + msg)
-        self.gLblStatus.update()
+        self.gLblStatus.update_idletasks()
 
     #Screen-switching.
     def GoMain(self, event):
@@ -410,3 +549,4 @@ class MainUI:
 
     def Quit(self, event):
         self.running = False
+        self.tkRoot.quit()
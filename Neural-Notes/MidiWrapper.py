@@ -7,6 +7,39 @@ See "acknowledgements" in NeuralNotes.py.
 
 import midi
 import numpy as num
+import heapq
+
+from Profiler import Profiled, Span
+
+#Bump this whenever MIDItoFV changes its output, so stale cached feature vectors get ignored.
+PARSER_VERSION = 1
+
+#Longest feature vector MIDItoFV will produce, in frames (sixteenth notes) - about 17 minutes at 120bpm.
+#Songs are kept whole up to this, whatever the number of timesteps we train with.
+DEFAULT_MAX_LENGTH = 8192
+
+#Yields (absolute tick, track index, position, event) for every event in a track.
+#Python-MIDI stores ticks relative to the previous event, so we accumulate as we go.
+def TrackEvents(track, trackIdx):
+    absTick = 0
+    for pos, tEvent in enumerate(track):
+        absTick += tEvent.tick
+        yield absTick, trackIdx, pos, tEvent
+
+#Write a chunk of generated samples out as MIDI files, numbered from firstIdx.
+#Lives at module level so it can be handed to a process pool. Returns how many files were written.
+def WriteSampleChunk(midiUtil, samples, saveLoc, firstIdx):
+    written = 0
+
+    for i, sample in enumerate(samples):
+        #Silent samples aren't worth a file.
+        if not sample.any():
+            continue
+
+        midiUtil.FVtoMIDI(sample, saveLoc + "/OutputSample-{}".format(firstIdx + i), verbose=False)
+        written += 1
+
+    return written
 
 class NNMidiUtility:
 
@@ -19,87 +52,72 @@ class NNMidiUtility:
         self.notespan = highBound - lowBound
         self.outputVelocity = 80
         self.tickScale = 60
+        self.maxLength = DEFAULT_MAX_LENGTH
 
+    @Profiled()
     def MIDItoFV(self, filename):
 
         #print(filename)
         #Grab the MIDI file as an event list from Python-MIDI.
-        midiEvents = midi.read_midifile(filename)
+        with Span("midi.read_midifile"):
+            midiEvents = midi.read_midifile(filename)
 
-        #Initialize lists for keeping track of...tracks.
-        trackTimes = [track[0].tick for track in midiEvents]
-        trackPos = [0 for track in midiEvents]
+        #Note states are sampled on every sixteenth note, offset by a thirty-second.
+        #Resolutions not divisible by 8 never land on a sampling tick, so we only ever get the leading silence.
+        frameStep = midiEvents.resolution // 4
+        nextFrame = midiEvents.resolution // 8 if midiEvents.resolution % 8 == 0 else None
 
-        #Initialize our feature vector.
-        #To start, this will be built as a matrix.
+        #Keep the current frame as separate "held" and "articulated" halves.
+        #Finished frames are written straight into the feature vector.
         fv = []
+        curOn = [0] * self.notespan
+        curArtic = [0] * self.notespan
 
-        curState = [[0,0] for n in range(self.notespan)]
-        prevState = curState
-
-        #Add a sample of silence to the beginning of the feature vector.
-        fv.append(curState)
+        #The first frame (a sample of silence) is open until the first sampling tick.
+        #Once the feature vector grows past maxLength we stop at the tick that pushed it over.
+        numFrames = 1
+        stopTick = 0 if numFrames > self.maxLength else None
 
-        keepParsing = True
-        tick = 0
+        #Walk every event in order of absolute time, rather than stepping through the file one tick at a time.
+        #Ties are broken by track, then by position within the track, same as a tick-by-tick scan.
+        for tick, _, _, tEvent in heapq.merge(*[TrackEvents(track, t) for t, track in enumerate(midiEvents)]):
 
-        while keepParsing:
+            #Register any new note states up to and including this tick.
+            while stopTick is None and nextFrame is not None and nextFrame <= tick:
+                fv.append(curOn + curArtic)
+                curArtic = [0] * self.notespan
+                numFrames += 1
+                nextFrame += frameStep
 
-            #Do we need to register a new note state?
-            if tick % (midiEvents.resolution / 4) == (midiEvents.resolution / 8):
-                prevState = curState
-                curState = [[prevState[n][0],0] for n in range(self.notespan)]
-                fv.append(curState)
+                if numFrames > self.maxLength:
+                    stopTick = nextFrame - frameStep
 
-            #Iterate over tracks and update note data.
-            for t in range(len(trackTimes)):
-
-                if not keepParsing:
-                    break
-
-                while trackTimes[t] == 0:
-
-                    track = midiEvents[t]
-                    tPos = trackPos[t]
-                    tEvent = track[tPos]
-
-                    if isinstance(tEvent, midi.NoteEvent):
-                        #Ignore out-of-range notes.
-                        if (tEvent.pitch < self.lowBound) or (tEvent.pitch >= self.highBound):
-                            pass
-                        #Register note "presses".
-                        elif isinstance(tEvent, midi.NoteOnEvent) and tEvent.velocity != 0:
-                            curState[tEvent.pitch - self.lowBound] = [1,1]
-                        #Register note "releases".
-                        else:
-                            curState[tEvent.pitch - self.lowBound] = [0,0]
-                    #Ignore non-4 time signatures FOR NOW.
-                    elif isinstance(tEvent, midi.TimeSignatureEvent):
-                        if tEvent.numerator not in (2, 4):
-                            keepParsing = False
-                            break
-
-                    if tPos + 1 < len(track):
-                        trackTimes[t] = track[tPos + 1].tick
-                        trackPos[t] += 1
-                    else:
-                        trackTimes[t] = None
-
-                if trackTimes[t] is not None:
-                    trackTimes[t] -= 1
-
-            if all(tTime is None for tTime in trackTimes) or len(fv) > self.maxLength:
+            if stopTick is not None and tick > stopTick:
                 break
 
-            tick += 1
+            if isinstance(tEvent, midi.NoteEvent):
+                #Ignore out-of-range notes.
+                if (tEvent.pitch < self.lowBound) or (tEvent.pitch >= self.highBound):
+                    pass
+                #Register note "presses".
+                elif isinstance(tEvent, midi.NoteOnEvent) and tEvent.velocity != 0:
+                    curOn[tEvent.pitch - self.lowBound] = 1
+                    curArtic[tEvent.pitch - self.lowBound] = 1
+                #Register note "releases".
+                else:
+                    curOn[tEvent.pitch - self.lowBound] = 0
+                    curArtic[tEvent.pitch - self.lowBound] = 0
+            #Ignore non-4 time signatures FOR NOW.
+            elif isinstance(tEvent, midi.TimeSignatureEvent):
+                if tEvent.numerator not in (2, 4):
+                    break
 
-        fvArray = num.array(fv)
-        fv = num.hstack((fvArray[:,:,0], fvArray[:,:,1]))
-        fv = num.asarray(fv).tolist()
+        fv.append(curOn + curArtic)
 
         return fv
 
-    def FVtoMIDI(self, fv, filename):
+    @Profiled()
+    def FVtoMIDI(self, fv, filename, verbose=True):
 
         #Process our feature vector/matrix.
         fv = num.array(fv)
@@ -113,47 +131,45 @@ class NNMidiUtility:
         track = midi.Track()
         midiEvents.append(track)
 
-        lTime = 0
-        prevState = [[0,0] for n in range(self.notespan)]
+        #Compare every frame against the one before it, over the whole piano roll at once.
+        #We start from silence, and close with a silent frame so anything still held gets released.
+        silence = num.zeros((1, self.notespan))
+        prevHeld = num.vstack((silence, fv[:, :, 0])) == 1
+        curHeld = num.vstack((fv[:, :, 0], silence))
+        curArtic = num.vstack((fv[:, :, 1], silence))
 
-        for fTime, fState in enumerate(fv + [prevState[:]]):
+        #Held notes are released when they stop, and re-pressed if they're articulated again.
+        #Anything that wasn't held is pressed as soon as it is.
+        notesOff = prevHeld & (curHeld == 0)
+        notesOn = (prevHeld & (curHeld != 0) & (curArtic == 1)) | (~prevHeld & (curHeld == 1))
 
-            notesOn = []
-            notesOff = []
+        #Line up the events by time, releases before presses, then by note.
+        offTimes, offNotes = num.nonzero(notesOff)
+        onTimes, onNotes = num.nonzero(notesOn)
 
-            for n in range(self.notespan):
+        eTimes = num.concatenate((offTimes, onTimes))
+        eNotes = num.concatenate((offNotes, onNotes))
+        ePress = num.concatenate((num.zeros(len(offTimes), bool), num.ones(len(onTimes), bool)))
 
-                note = fState[n]
-                prevNote = prevState[n]
+        order = num.lexsort((eNotes, ePress, eTimes))
+        eTicks = (num.diff(eTimes[order], prepend=0) * self.tickScale).tolist()
+        ePitches = (eNotes[order] + self.lowBound).tolist()
 
-                #Read in any note on/off events.
-                if prevNote[0] == 1:
-                    if note[0] == 0:
-                        notesOff.append(n)
-                    elif note[1] == 1:
-                        notesOn.append(n)
-                elif note[0] == 1:
-                    notesOn.append(n)
+        #Write out events for pressing/releasing notes.
+        for tick, pitch, press in zip(eTicks, ePitches, ePress[order].tolist()):
 
-            #Write out events for releasing notes.
-            for note in notesOff:
-
-                track.append(midi.NoteOffEvent(tick = (fTime - lTime) * self.tickScale,
-                                               pitch = note + self.lowBound))
-                lTime = fTime
-
-            #Write out events for pressing notes.
-            for note in notesOn:
-
-                track.append(midi.NoteOnEvent(tick = (fTime - lTime) * self.tickScale,
+            if press:
+                track.append(midi.NoteOnEvent(tick = tick,
                                               velocity = self.outputVelocity,
-                                              pitch = note + self.lowBound))
-                lTime = fTime
-
-            prevState = fState
+                                              pitch = pitch))
+            else:
+                track.append(midi.NoteOffEvent(tick = tick,
+                                               pitch = pitch))
 
         #Cap the event list and output the MIDI file.
         track.append(midi.EndOfTrackEvent(tick = 1))
-        midi.write_midifile("{}.midi".format(filename), midiEvents)
+        with Span("midi.write_midifile"):
+            midi.write_midifile("{}.midi".format(filename), midiEvents)
 
-        print("Wrote MIDI file: " + "{}.midi".format(filename))
+        if verbose:
+            print("Wrote MIDI file: " + "{}.midi".format(filename))
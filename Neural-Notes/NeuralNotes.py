@@ -22,30 +22,33 @@ And, of course, the Tensorflow documentation:
 https://www.tensorflow.org/api_docs/python/
 '''
 
+import time
+
+#Startup timing - reported once the window is ready, so slow starts are easy to spot.
+startupTimes = [("start", time.perf_counter())]
+
 import RBMNet as rbm
 import MidiWrapper as nn_midi
 import GUIWrapper as gui
-import time
 
-#Initialize core application objects.
-MAX_FRAME_RATE = 60
+startupTimes.append(("imports", time.perf_counter()))
 
-frame = gui.FrameMgr(MAX_FRAME_RATE)
-appData = gui.AppData()
-mainUI = gui.MainUI()
+#How often (in ms) to check on a background job while one is running.
+TASK_POLL_MS = 50
 
-midiUtil = nn_midi.NNMidiUtility()
-rbmNet = rbm.RBMNet(midiUtil)
+#Optional frame-timing probe - samples how responsive the Tkinter loop is, and reports to the console.
+FRAME_PROBE = False
+MAX_FRAME_RATE = 60
+FRAME_REPORT_SECS = 5.0
 
 #Global Tkinter callbacks.
 def WindowCloseCallback():
     mainUI.running = False
+    mainUI.tkRoot.quit()
     return
 
-def LoadTrainingSet(event):
-    mainUI.SetTrainStatus("Loading dataset...")
-
-    #Confirm the number of timesteps.
+#Confirm the number of timesteps.
+def ReadTimesteps():
     try:
         tmpTimesteps = int(mainUI.tTxtTimesteps.get())
         rbm.DEFAULT_TIMESTEPS = tmpTimesteps
@@ -53,8 +56,53 @@ def LoadTrainingSet(event):
         mainUI.tTxtTimesteps.delete(0, 'end')
         mainUI.tTxtTimesteps.insert(0, rbm.DEFAULT_TIMESTEPS)
 
-    loadSuccess = rbmNet.LoadTrainingSet(appData.trainDataDirectory)
-    mainUI.SetTrainStatus("Dataset loaded" if loadSuccess else "Dataset loading failed")
+#Only one long-running job (loading/training/generating) runs at a time.
+def CheckBusy(setStatus):
+    if taskRunner.IsBusy():
+        setStatus("Busy - wait for the current job to finish, or cancel it")
+        return True
+
+    return False
+
+#Start a background job, and keep an eye on it until it's done.
+def StartTask(job, statusFn, doneFn):
+    if taskRunner.Start(job, statusFn, doneFn):
+        mainUI.tkRoot.after(TASK_POLL_MS, PollTask)
+
+#Pick up progress/results from the background job.
+#Only scheduled while a job is running, so an idle app has nothing to wake up for.
+def PollTask():
+    taskRunner.Poll()
+
+    if mainUI.running and (taskRunner.IsBusy() or not taskRunner.messages.empty()):
+        mainUI.tkRoot.after(TASK_POLL_MS, PollTask)
+
+    return
+
+def CancelTask(event):
+    if taskRunner.IsBusy():
+        taskRunner.statusFn("Cancelling...")
+        taskRunner.Cancel()
+
+    return
+
+def LoadTrainingSet(event):
+    if CheckBusy(mainUI.SetTrainStatus):
+        return
+
+    mainUI.SetTrainStatus("Loading dataset...")
+    ReadTimesteps()
+
+    directory = appData.trainDataDirectory
+    StartTask(lambda: rbmNet.LoadTrainingSet(directory), mainUI.SetTrainStatus, LoadTrainingSetDone)
+
+    return
+
+def LoadTrainingSetDone(loadSuccess):
+    if taskRunner.IsCancelled():
+        mainUI.SetTrainStatus("Dataset loading cancelled")
+    else:
+        mainUI.SetTrainStatus("Dataset loaded" if loadSuccess else "Dataset loading failed")
 
     return
 
@@ -83,6 +131,9 @@ def GetSampleSaveDirectory(event):
     return
 
 def TriggerGen(event):
+    if CheckBusy(mainUI.SetGenStatus):
+        return
+
     mainUI.SetGenStatus("Generating samples...")
 
     #Extract info from our generation parameter fields.
@@ -100,11 +151,24 @@ def TriggerGen(event):
         mainUI.gTxtTimescale.delete(0, 'end')
         mainUI.gTxtSamples.insert(0, midiUtil.tickScale)
 
-    genResult = rbmNet.Generate(event, appData.modelLoadDirectory, appData.sampleSaveDirectory)
-    mainUI.SetGenStatus("Finished generating samples" if genResult else "Sample generation failed")
+    loadDir = appData.modelLoadDirectory
+    saveDir = appData.sampleSaveDirectory
+    StartTask(lambda: rbmNet.Generate(None, loadDir, saveDir), mainUI.SetGenStatus, TriggerGenDone)
+
+    return
+
+def TriggerGenDone(genResult):
+    if taskRunner.IsCancelled():
+        mainUI.SetGenStatus("Sample generation cancelled")
+    else:
+        mainUI.SetGenStatus("Finished generating samples" if genResult else "Sample generation failed")
+
     return
 
 def TriggerTrain(event):
+    if CheckBusy(mainUI.SetTrainStatus):
+        return
+
     mainUI.SetTrainStatus("Training...")
 
     #Extract info from our training parameter fields.
@@ -122,14 +186,8 @@ def TriggerTrain(event):
         mainUI.tTxtLearn.delete(0, 'end')
         mainUI.tTxtLearn.insert(0, rbm.DEFAULT_LEARNRATE)
 
-    try:
-        #For timesteps, if the number has increased, we need to re-load
-        #training data.
-        tmpTimesteps = int(mainUI.tTxtTimesteps.get())
-        if tmpTimesteps != rbm.DEFAULT_TIMESTEPS :
-            LoadTrainingSet(event)
-    except Exception:
-        pass
+    #Songs are kept at full length, so a new number of timesteps just changes how they're windowed - no reload needed.
+    ReadTimesteps()
 
     try:
         tmpNodes = int(mainUI.tTxtNodes.get())
@@ -138,69 +196,126 @@ def TriggerTrain(event):
         mainUI.tTxtNodes.delete(0, 'end')
         mainUI.tTxtNodes.insert(0, rbm.DEFAULT_HNODES)
 
-    rbmNet.InitNNParameters()
-    trainResult = rbmNet.Train(event, appData.modelSaveDirectory if mainUI.saveModel.get() else None)
-    mainUI.SetTrainStatus("Training complete" if trainResult else "Training failed")
+    saveDir = appData.modelSaveDirectory if mainUI.saveModel.get() else None
+
+    #Training happens on the background thread.
+    def TrainJob():
+        rbmNet.InitNNParameters()
+        return rbmNet.Train(None, saveDir)
+
+    StartTask(TrainJob, mainUI.SetTrainStatus, TriggerTrainDone)
+
+    return
+
+def TriggerTrainDone(trainResult):
+    if taskRunner.IsCancelled():
+        mainUI.SetTrainStatus("Training cancelled")
+    else:
+        mainUI.SetTrainStatus("Training complete" if trainResult else "Training failed")
 
     if trainResult:
         mainUI.SetGenStatus("Ready")
 
     return
 
-#Setup global Tkinter handlers.
-mainUI.tkRoot.protocol("WM_DELETE_WINDOW", WindowCloseCallback)
-mainUI.tBtnChooseData.bind("<ButtonRelease-1>", appData.GetTrainDirectory)
-mainUI.tBtnLoadData.bind("<ButtonRelease-1>", LoadTrainingSet)
-mainUI.tBtnChooseSave.bind("<ButtonRelease-1>", GetModelSaveDirectory)
-mainUI.tBtnTrain.bind("<ButtonRelease-1>", TriggerTrain)
-mainUI.gBtnChooseModel.bind("<ButtonRelease-1>", GetModelLoadDirectory)
-mainUI.gBtnChooseSave.bind("<ButtonRelease-1>", GetSampleSaveDirectory)
-mainUI.gBtnGen.bind("<ButtonRelease-1>", TriggerGen)
-
-#Initialize Tkinter UI labels/elements.
-#Training/model parameters.
-mainUI.tTxtTimesteps.delete(0, 'end')
-mainUI.tTxtTimesteps.insert(0, rbm.DEFAULT_TIMESTEPS)
-mainUI.tTxtEpochs.delete(0, 'end')
-mainUI.tTxtEpochs.insert(0, rbm.DEFAULT_EPOCHS)
-mainUI.tTxtLearn.delete(0, 'end')
-mainUI.tTxtLearn.insert(0, rbm.DEFAULT_LEARNRATE)
-mainUI.tTxtNodes.delete(0, 'end')
-mainUI.tTxtNodes.insert(0, rbm.DEFAULT_HNODES)
-
-#Generation parameters.
-mainUI.gTxtTimescale.delete(0, 'end')
-mainUI.gTxtTimescale.insert(0, midiUtil.tickScale)
-mainUI.gTxtSamples.delete(0, 'end')
-mainUI.gTxtSamples.insert(0, rbmNet.genSample)
-mainUI.gLblSaveDir.configure(text="Saving samples to " + rbm.SAMPLE_LOC)
-
-#Status messages.
-mainUI.SetTrainStatus("No data available")
-mainUI.SetGenStatus("Ready" if rbmNet.IsTmpModelStored() else "No model available")
+#Print how long each stage of startup took.
+def ReportStartupTimes():
+    stages = ["{} {:.3f}s".format(name, t - prevT) for (_, prevT), (name, t) in zip(startupTimes, startupTimes[1:])]
+    print("Startup: " + ", ".join(stages) + " (total {:.3f}s)".format(startupTimes[-1][1] - startupTimes[0][1]))
 
-#Main loop.
-def AppMain():
+#Frame-timing probe - ticks at the target frame rate and periodically reports how far behind it fell.
+def ProbeFrame():
+    frame.Tick()
 
-    while mainUI.running:
+    if frame.TimeSinceReport() >= FRAME_REPORT_SECS:
+        print("Frame timing: " + frame.Report())
 
-        frame.Tick()
+    if mainUI.running:
+        mainUI.tkRoot.after(int(frame.targetDelta * 1000), ProbeFrame)
 
-        mainUI.tkRoot.update_idletasks()
-        mainUI.tkRoot.update()
+    return
 
-        if frame.TimeSinceTick() < frame.targetDelta:
-            time.sleep(frame.targetDelta - frame.TimeSinceTick())
+#Main loop.
+#Tkinter's own loop sleeps until there's something to do - background jobs and the frame probe
+#schedule themselves with after() as needed.
+def AppMain():
+
+    if FRAME_PROBE:
+        mainUI.tkRoot.after(int(frame.targetDelta * 1000), ProbeFrame)
+
+    mainUI.tkRoot.mainloop()
 
     return
 
 #Global resource cleanup.
 def Cleanup():
+    taskRunner.Cancel()
+
+    #The job thread is a daemon, so it would die with us - possibly halfway through saving a model.
+    #Cancelled jobs stop at the next epoch/chunk and leave the previous model alone, so wait for that.
+    if taskRunner.thread is not None and taskRunner.thread.is_alive():
+        print("Waiting for the current job to stop...")
+        taskRunner.thread.join()
+
     mainUI.tkRoot.destroy()
     return
 
-#Jump in to the application!
-frame.Tick()
-AppMain()
-#Destroy all the evidence!
-Cleanup()
\ No newline at end of file
+#Everything below only runs when launched directly.
+#Worker processes (used when loading training data) re-import this script, and shouldn't open windows of their own.
+if __name__ == '__main__':
+
+    #Initialize core application objects.
+    frame = gui.FrameMgr(MAX_FRAME_RATE)
+    appData = gui.AppData()
+    mainUI = gui.MainUI()
+    taskRunner = gui.TaskRunner()
+    startupTimes.append(("UI", time.perf_counter()))
+
+    midiUtil = nn_midi.NNMidiUtility()
+    rbmNet = rbm.RBMNet(midiUtil)
+    rbmNet.progressCallback = taskRunner.Progress
+    rbmNet.cancelEvent = taskRunner.cancelEvent
+    startupTimes.append(("RBM setup", time.perf_counter()))
+
+    #Setup global Tkinter handlers.
+    mainUI.tkRoot.protocol("WM_DELETE_WINDOW", WindowCloseCallback)
+    mainUI.tBtnChooseData.bind("<ButtonRelease-1>", appData.GetTrainDirectory)
+    mainUI.tBtnLoadData.bind("<ButtonRelease-1>", LoadTrainingSet)
+    mainUI.tBtnChooseSave.bind("<ButtonRelease-1>", GetModelSaveDirectory)
+    mainUI.tBtnTrain.bind("<ButtonRelease-1>", TriggerTrain)
+    mainUI.gBtnChooseModel.bind("<ButtonRelease-1>", GetModelLoadDirectory)
+    mainUI.gBtnChooseSave.bind("<ButtonRelease-1>", GetSampleSaveDirectory)
+    mainUI.gBtnGen.bind("<ButtonRelease-1>", TriggerGen)
+    mainUI.tBtnCancel.bind("<ButtonRelease-1>", CancelTask)
+    mainUI.gBtnCancel.bind("<ButtonRelease-1>", CancelTask)
+
+    #Initialize Tkinter UI labels/elements.
+    #Training/model parameters.
+    mainUI.tTxtTimesteps.delete(0, 'end')
+    mainUI.tTxtTimesteps.insert(0, rbm.DEFAULT_TIMESTEPS)
+    mainUI.tTxtEpochs.delete(0, 'end')
+    mainUI.tTxtEpochs.insert(0, rbm.DEFAULT_EPOCHS)
+    mainUI.tTxtLearn.delete(0, 'end')
+    mainUI.tTxtLearn.insert(0, rbm.DEFAULT_LEARNRATE)
+    mainUI.tTxtNodes.delete(0, 'end')
+    mainUI.tTxtNodes.insert(0, rbm.DEFAULT_HNODES)
+
+    #Generation parameters.
+    mainUI.gTxtTimescale.delete(0, 'end')
+    mainUI.gTxtTimescale.insert(0, midiUtil.tickScale)
+    mainUI.gTxtSamples.delete(0, 'end')
+    mainUI.gTxtSamples.insert(0, rbmNet.genSample)
+    mainUI.gLblSaveDir.configure(text="Saving samples to " + rbm.SAMPLE_LOC)
+
+    #Status messages.
+    mainUI.SetTrainStatus("No data available")
+    mainUI.SetGenStatus("Ready" if rbmNet.IsTmpModelStored() else "No model available")
+    startupTimes.append(("UI init", time.perf_counter()))
+
+    ReportStartupTimes()
+
+    #Jump in to the application!
+    frame.Tick()
+    AppMain()
+    #Destroy all the evidence!
+    Cleanup()
@@ -0,0 +1,320 @@
+'''
+NEURALNOTESBENCH.PY
+Benchmark suite - times each stage of the pipeline against one of the bundled training sets.
+
+Usage:
+python NeuralNotesBench.py [--data <training folder>] [--out results.json] [options]
+python NeuralNotesBench.py --baseline results.json [--threshold 0.1] [options]
+
+Measures:
+parse - MIDItoFV over every file (files/sec, frames/sec), no cache.
+load - LoadTrainingSet wall time, with a cold and then a warm feature vector cache.
+train - Train updates/sec for each hidden nodes/timesteps combination asked for (feed_dict, and optionally tf.data).
+generate - Generate latency for a single sample (cold and resident model), and samples/sec for a batch.
+write - FVtoMIDI throughput, converting the loaded songs back to MIDI.
+
+Results are printed and saved as JSON. Given a baseline from an earlier run, any metric that got worse
+by more than the threshold is flagged and the exit code is 1.
+
+Everything (models, samples, cache) is written to a scratch folder, so the cached model and samples are left alone.
+
+DEPENDENCIES:
+
+Argparse/JSON - command line and results.
+Tempfile/Shutil - scratch folder.
+Numpy - math library.
+'''
+
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as num
+
+import RBMNet as rbm
+import MidiWrapper as nn_midi
+from FVCache import FVCache
+
+DEFAULT_DATA = os.path.dirname(os.path.realpath(__file__)) + '/training/Banjo-KazooieSet'
+DEFAULT_THRESHOLD = 0.1
+
+#Metrics where smaller is better - everything else is a rate.
+LOWER_IS_BETTER = ("seconds", "latency")
+
+#Best-of-repeat timing of fn, which is run with no arguments. Returns (seconds, last result).
+def TimeBest(fn, repeat):
+    best = None
+    result = None
+
+    for i in range(repeat):
+        startTime = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - startTime
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+def Rate(count, seconds):
+    return round(count / max(seconds, 1e-9), 3)
+
+#Comma-separated list of integers, e.g. "50,100".
+def IntList(text):
+    try:
+        return [int(value) for value in text.split(",") if value.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a comma-separated list of integers, got " + text)
+
+def BenchParse(args, midiUtil, fileset):
+    frameCount = [0]
+
+    def ParseAll():
+        frameCount[0] = sum(len(midiUtil.MIDItoFV(midifile)) for midifile in fileset)
+
+    seconds, _ = TimeBest(ParseAll, args.repeat)
+
+    return {"files": len(fileset), "frames": frameCount[0], "seconds": round(seconds, 6),
+            "files_per_sec": Rate(len(fileset), seconds), "frames_per_sec": Rate(frameCount[0], seconds)}
+
+def BenchLoad(args, rbmNet, scratch):
+    rbmNet.fvCache = FVCache(os.path.join(scratch, "fv_cache"))
+
+    #Cold is a fresh, empty cache every time, so repeats stay cold.
+    def LoadCold():
+        rbmNet.fvCache.Clear()
+        return rbmNet.LoadTrainingSet(args.data)
+
+    coldSeconds, _ = TimeBest(LoadCold, args.repeat)
+    warmSeconds, _ = TimeBest(lambda: rbmNet.LoadTrainingSet(args.data), args.repeat)
+
+    return {"songs": len(rbmNet.trainDataset), "cold_seconds": round(coldSeconds, 6),
+            "warm_seconds": round(warmSeconds, 6)}
+
+#Best of the throughput Train reports itself, which leaves out graph building and saving.
+def TrainRate(args, rbmNet, hNodes, timesteps, useDataset, stepsPerRun):
+    rate = None
+
+    for i in range(args.repeat):
+        rbmNet.InitNNParameters()
+        rbmNet.hNodes = hNodes
+        rbmNet.timesteps = timesteps
+        rbmNet.epochs = args.epochs
+        rbmNet.useDataset = useDataset
+        rbmNet.stepsPerRun = stepsPerRun
+
+        if not rbmNet.Train(None, None):
+            raise RuntimeError("Training failed for {} hidden nodes, {} timesteps".format(hNodes, timesteps))
+
+        stats = rbmNet.trainStats
+        rate = max(rate or 0, Rate(stats["steps"], stats["seconds"]))
+
+    return rate
+
+#updates_per_sec is always the feed_dict path. Asking for tf.data (or more than one step per run, which always goes
+#through tf.data) times that path too, reported alongside as tf_data_updates_per_sec.
+def BenchTrain(args, rbmNet, scratch):
+    results = {}
+    compareDataset = args.dataset or args.steps_per_run != 1
+
+    try:
+        for hNodes in args.hnodes:
+            for timesteps in args.timesteps:
+                result = {"updates_per_sec": TrainRate(args, rbmNet, hNodes, timesteps, False, 1)}
+
+                if compareDataset:
+                    result["steps_per_run"] = args.steps_per_run
+                    result["tf_data_updates_per_sec"] = TrainRate(args, rbmNet, hNodes, timesteps, True,
+                                                                  args.steps_per_run)
+
+                results["h{}_t{}".format(hNodes, timesteps)] = result
+    finally:
+        rbmNet.useDataset = False
+        rbmNet.stepsPerRun = rbm.DEFAULT_STEPSPERRUN
+
+    return results
+
+def BenchGenerate(args, rbmNet, scratch):
+    sampleDir = os.path.join(scratch, "samples")
+    os.makedirs(sampleDir, exist_ok=True)
+
+    def GenerateOne():
+        rbmNet.genSample = 1
+        return rbmNet.Generate(None, None, sampleDir)
+
+    #Cold pays for loading the model; after that it's resident.
+    def GenerateOneCold():
+        rbmNet.ClearModelCache()
+        return GenerateOne()
+
+    coldSeconds, _ = TimeBest(GenerateOneCold, args.repeat)
+    warmSeconds, _ = TimeBest(GenerateOne, args.repeat)
+
+    def GenerateBatch():
+        rbmNet.genSample = args.samples
+        return rbmNet.Generate(None, None, sampleDir)
+
+    batchSeconds, _ = TimeBest(GenerateBatch, args.repeat)
+
+    return {"cold_latency": round(coldSeconds, 6), "warm_latency": round(warmSeconds, 6),
+            "samples": args.samples, "samples_per_sec": Rate(args.samples, batchSeconds)}
+
+def BenchWrite(args, midiUtil, songs, scratch):
+    writeDir = os.path.join(scratch, "write")
+    os.makedirs(writeDir, exist_ok=True)
+    frames = sum(len(song) for song in songs)
+
+    def WriteAll():
+        for i, song in enumerate(songs):
+            midiUtil.FVtoMIDI(song, os.path.join(writeDir, "Song-{}".format(i)), verbose=False)
+
+    seconds, _ = TimeBest(WriteAll, args.repeat)
+
+    return {"files": len(songs), "frames": frames, "seconds": round(seconds, 6),
+            "files_per_sec": Rate(len(songs), seconds), "frames_per_sec": Rate(frames, seconds)}
+
+#Flatten nested results into "bench.metric" keys.
+def Flatten(results, prefix=""):
+    flat = {}
+
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(Flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+
+    return flat
+
+#Compare against a baseline run. Counts (files, songs...) are skipped - only timings and rates are checked.
+#Returns a list of (metric, baseline, current, change) for everything that got worse by more than threshold.
+def FindRegressions(results, baseline, threshold):
+    current = Flatten(results)
+    regressions = []
+
+    for metric, before in Flatten(baseline).items():
+        after = current.get(metric)
+        lowerIsBetter = any(metric.endswith(suffix) for suffix in LOWER_IS_BETTER)
+
+        if after is None or before <= 0 or not (lowerIsBetter or metric.endswith("_per_sec")):
+            continue
+
+        #Positive change means slower, whichever way the metric runs.
+        change = (after - before) / before if lowerIsBetter else (before - after) / before
+
+        if change > threshold:
+            regressions.append((metric, before, after, change))
+
+    return regressions
+
+def BuildParser():
+    parser = argparse.ArgumentParser(description="Benchmark the Neural Notes pipeline on a training set.")
+    parser.add_argument("--data", default=DEFAULT_DATA, help="folder of MIDI files to benchmark with")
+    parser.add_argument("--out", metavar="FILE", help="write the results JSON here")
+    parser.add_argument("--baseline", metavar="FILE", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="fraction a metric may get worse by before it counts as a regression")
+    parser.add_argument("--only", type=lambda text: text.split(","), metavar="B1,B2,...",
+                        help="run just these benchmarks (parse, load, train, generate, write)")
+    parser.add_argument("--repeat", type=int, default=1, help="repeat each measurement, keeping the best")
+    parser.add_argument("--numpy", action="store_true", help="use the NumPy engine instead of Tensorflow")
+    parser.add_argument("--workers", type=int, default=rbm.DEFAULT_LOADWORKERS, help="processes to load with")
+    parser.add_argument("--hnodes", type=IntList, default=[rbm.DEFAULT_HNODES], metavar="H1,H2,...")
+    parser.add_argument("--timesteps", type=IntList, default=[rbm.DEFAULT_TIMESTEPS], metavar="T1,T2,...")
+    parser.add_argument("--epochs", type=int, default=5, help="epochs per training run")
+    parser.add_argument("--dataset", action="store_true",
+                        help="also time training with batches fed through tf.data, next to feed_dict")
+    parser.add_argument("--steps-per-run", type=int, default=rbm.DEFAULT_STEPSPERRUN,
+                        help="updates per session.run for the tf.data timing (0 for a whole epoch)")
+    parser.add_argument("--samples", type=int, default=100, help="samples for the generation throughput run")
+    return parser
+
+def Main(argv=None):
+    parser = BuildParser()
+    args = parser.parse_args(argv)
+
+    if args.numpy and (args.dataset or args.steps_per_run != 1):
+        parser.error("--dataset and --steps-per-run only apply to the Tensorflow engine")
+
+    benches = args.only or ["parse", "load", "train", "generate", "write"]
+
+    fileset = sorted(glob.glob("{}/*.mid*".format(args.data)))
+
+    if not fileset:
+        print("No MIDI files found in " + args.data)
+        return 1
+
+    #Keep models and samples out of the real data folders.
+    scratch = tempfile.mkdtemp(prefix="nnbench-")
+    rbm.MODEL_SAVE_LOC = os.path.join(scratch, "tmp_model")
+    rbm.SAMPLE_LOC = os.path.join(scratch, "sampleout")
+
+    midiUtil = nn_midi.NNMidiUtility()
+
+    rbmNet = rbm.RBMNet(midiUtil)
+    rbmNet.useNumpy = args.numpy
+    rbmNet.loadWorkers = args.workers
+
+    results = {}
+
+    try:
+        if "parse" in benches:
+            results["parse"] = BenchParse(args, midiUtil, fileset)
+
+        #Everything past parsing needs the training set loaded.
+        if any(bench != "parse" for bench in benches):
+            if "load" in benches:
+                results["load"] = BenchLoad(args, rbmNet, scratch)
+            else:
+                rbmNet.useFVCache = False
+                rbmNet.LoadTrainingSet(args.data)
+
+        if "train" in benches:
+            results["train"] = BenchTrain(args, rbmNet, scratch)
+
+        #Generation needs a model to sample from - a quick one will do.
+        elif "generate" in benches:
+            rbmNet.InitNNParameters()
+            rbmNet.epochs = 1
+            rbmNet.Train(None, None)
+
+        if "generate" in benches:
+            results["generate"] = BenchGenerate(args, rbmNet, scratch)
+
+        if "write" in benches:
+            results["write"] = BenchWrite(args, midiUtil, rbmNet.trainDataset, scratch)
+    finally:
+        rbmNet.ClearModelCache()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {"meta": {"data": os.path.basename(os.path.normpath(args.data)), "engine": "numpy" if args.numpy else "tensorflow",
+                       "python": platform.python_version(), "numpy": num.__version__, "machine": platform.machine(),
+                       "time": time.strftime("%Y-%m-%d %H:%M:%S")},
+              "results": results}
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.out is not None:
+        with open(args.out, 'w') as outFile:
+            json.dump(report, outFile, indent=2, sort_keys=True)
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as baselineFile:
+        regressions = FindRegressions(results, json.load(baselineFile)["results"], args.threshold)
+
+    for metric, before, after, change in regressions:
+        print("REGRESSION {}: {} -> {} ({:.1%} worse)".format(metric, before, after, change))
+
+    if not regressions:
+        print("No regressions beyond {:.0%}.".format(args.threshold))
+
+    return 1 if regressions else 0
+
+#Guarded, since worker processes re-import this script.
+if __name__ == '__main__':
+    sys.exit(Main())
@@ -0,0 +1,251 @@
+'''
+NEURALNOTESCLI.PY
+Headless command-line entry point - everything the UI can do, without opening a window.
+Handy for scripted model builds and big generation runs on machines with no display.
+
+Usage:
+python NeuralNotesCLI.py load <training folder> [options]
+python NeuralNotesCLI.py train <training folder> [--save <empty folder>] [options]
+python NeuralNotesCLI.py generate [--model <model folder>] [--out <sample folder>] [options]
+python NeuralNotesCLI.py convert <model folder> [<model folder> ...]
+
+Run any subcommand with -h for the full list of options.
+Once finished, a single line of JSON with the timing of each phase is printed (and optionally written to a file).
+
+Note that this deliberately doesn't touch GUIWrapper, so Tkinter and PIL are never imported.
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import RBMNet as rbm
+import MidiWrapper as nn_midi
+import Profiler
+from RBMNumpy import PRECISIONS
+from Corpus import CORPUS_EXT
+
+#Run fn, recording how long it took under the given name.
+def Timed(timing, name, fn, *args):
+    startTime = time.perf_counter()
+    result = fn(*args)
+    timing[name] = round(time.perf_counter() - startTime, 6)
+    return result
+
+#The same fields the UI reads before training, plus batch size.
+#Like the UI, these go through RBMNet's module defaults, which InitNNParameters picks up.
+def ApplyTrainingArgs(args):
+    rbm.DEFAULT_TIMESTEPS = args.timesteps
+    rbm.DEFAULT_EPOCHS = args.epochs
+    rbm.DEFAULT_LEARNRATE = args.learnrate
+    rbm.DEFAULT_HNODES = args.hnodes
+    rbm.DEFAULT_BATCHSIZE = args.batchsize
+
+def MakeNet(args):
+    midiUtil = nn_midi.NNMidiUtility()
+    rbmNet = rbm.RBMNet(midiUtil)
+
+    rbmNet.useNumpy = args.numpy
+
+    if args.command in ("load", "train"):
+        rbmNet.loadWorkers = args.workers
+        rbmNet.useFVCache = not args.no_cache
+        rbmNet.corpusFile = args.corpus
+        midiUtil.maxLength = args.max_frames
+
+    if args.command == "train":
+        rbmNet.useDataset = args.dataset
+        rbmNet.stepsPerRun = args.steps_per_run
+        rbmNet.checkpointEpochs = args.checkpoints
+        rbmNet.windowHop = args.hop
+        rbmNet.transposeRange = args.transpose
+        rbmNet.checkpointWeightsOnly = args.checkpoint_weights_only
+
+        if args.checkpoint_dir is not None:
+            rbmNet.checkpointDir = args.checkpoint_dir
+
+        rbmNet.resumeDir = args.resume
+
+    if args.command == "generate":
+        midiUtil.tickScale = args.tickscale
+        rbmNet.genChunkSize = args.chunksize
+        rbmNet.genWorkers = args.gen_workers
+        rbmNet.genPrecision = args.precision
+
+    return rbmNet
+
+def RunLoad(args, rbmNet, timing):
+    if not Timed(timing, "load", rbmNet.LoadTrainingSet, args.data):
+        return False
+
+    timing["songs"] = len(rbmNet.trainDataset)
+    return True
+
+def RunTrain(args, rbmNet, timing):
+    ApplyTrainingArgs(args)
+
+    #The UI only saves to empty folders, and so do we - Train would just skip anything else and only cache the model,
+    #so refuse up front rather than "succeed" without saving it where we were asked to.
+    if args.save is not None and os.path.exists(args.save):
+        if not os.path.isdir(args.save) or os.listdir(args.save):
+            print("Can't save the model to " + args.save + " - it needs to be an empty folder.")
+            return False
+
+    if not RunLoad(args, rbmNet, timing):
+        return False
+
+    #Create the save folder if it isn't there yet.
+    if args.save is not None:
+        os.makedirs(args.save, exist_ok=True)
+
+    rbmNet.InitNNParameters()
+    return Timed(timing, "train", rbmNet.Train, None, args.save)
+
+def RunGenerate(args, rbmNet, timing):
+    rbmNet.genSample = args.samples
+
+    #Generate falls back to the cached model for anything that isn't a folder - fine for the UI, but here a typo
+    #would quietly sample from whatever was trained last.
+    if args.model is not None and not os.path.isdir(args.model):
+        print("No model folder at " + args.model)
+        return False
+
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok=True)
+
+    if not Timed(timing, "generate", rbmNet.Generate, None, args.model, args.out):
+        return False
+
+    timing["samples"] = args.samples
+    timing["samples_per_sec"] = round(args.samples / max(timing["generate"], 1e-9), 3)
+    return True
+
+#Write a compact weights file next to each SavedModel, so it can be used without Tensorflow.
+def RunConvert(args, rbmNet, timing):
+    converted = 0
+
+    for modelDir in args.models:
+        if rbmNet.ExportNumpyWeights(modelDir):
+            converted += 1
+
+    timing["converted"] = converted
+    return converted == len(args.models)
+
+#Parse a comma-separated list of epochs, e.g. "20,45,75".
+def EpochList(text):
+    try:
+        return sorted(set(int(epoch) for epoch in text.split(",") if epoch.strip()))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a comma-separated list of epochs, got " + text)
+
+#Parse a whole number that can't be negative, e.g. a window hop.
+def NonNegativeInt(text):
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a whole number, got " + text)
+
+    if value < 0:
+        raise argparse.ArgumentTypeError("can't be negative, got " + text)
+
+    return value
+
+def BuildParser():
+    parser = argparse.ArgumentParser(description="Train and sample Neural Notes models without the UI.")
+    parser.add_argument("--timing", metavar="FILE", help="also write the timing JSON to this file")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="record where the time goes, print a summary and write a Chrome trace to this file")
+    parser.add_argument("--profile-memory", action="store_true", help="also track peak memory per phase (slower)")
+    parser.add_argument("--numpy", action="store_true", help="use the NumPy engine instead of Tensorflow")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    #Loading options are shared by load and train.
+    loadArgs = argparse.ArgumentParser(add_help=False)
+    loadArgs.add_argument("data", help="folder of MIDI files to train on, or a corpus file (" + CORPUS_EXT + ")")
+    loadArgs.add_argument("--workers", type=int, default=rbm.DEFAULT_LOADWORKERS,
+                          help="processes to parse MIDI files with")
+    loadArgs.add_argument("--no-cache", action="store_true", help="don't use the feature vector cache")
+    loadArgs.add_argument("--max-frames", type=int, default=nn_midi.DEFAULT_MAX_LENGTH,
+                          help="cut songs off after this many frames (sixteenth notes)")
+    loadArgs.add_argument("--corpus", metavar="FILE",
+                          help="stream the parsed songs into this corpus file instead of memory (train from it later)")
+
+    trainArgs = argparse.ArgumentParser(add_help=False)
+    trainArgs.add_argument("--timesteps", type=int, default=rbm.DEFAULT_TIMESTEPS)
+    trainArgs.add_argument("--epochs", type=int, default=rbm.DEFAULT_EPOCHS)
+    trainArgs.add_argument("--learnrate", type=float, default=rbm.DEFAULT_LEARNRATE)
+    trainArgs.add_argument("--hnodes", type=int, default=rbm.DEFAULT_HNODES, help="hidden nodes")
+    trainArgs.add_argument("--batchsize", type=int, default=rbm.DEFAULT_BATCHSIZE)
+    trainArgs.add_argument("--hop", type=NonNegativeInt, default=rbm.DEFAULT_WINDOWHOP,
+                           help="frames between the starts of training windows (less than timesteps overlaps them; "
+                                "0 for back-to-back windows)")
+    trainArgs.add_argument("--save", metavar="DIR", help="empty folder to save the model to (always cached too)")
+    trainArgs.add_argument("--transpose", type=int, default=rbm.DEFAULT_TRANSPOSE, metavar="SEMITONES",
+                           help="randomly transpose each training window by up to this many semitones either way")
+    trainArgs.add_argument("--resume", metavar="DIR",
+                           help="keep training an existing model (same timesteps) instead of starting fresh")
+    trainArgs.add_argument("--dataset", action="store_true", help="feed batches through tf.data")
+    trainArgs.add_argument("--steps-per-run", type=int, default=rbm.DEFAULT_STEPSPERRUN,
+                           help="updates per session.run (0 for a whole epoch)")
+    trainArgs.add_argument("--checkpoints", type=EpochList, default=[], metavar="E1,E2,...",
+                           help="epochs to snapshot the model at, e.g. 20,45,75")
+    trainArgs.add_argument("--checkpoint-dir", metavar="DIR", help="where snapshots go (one folder per epoch)")
+    trainArgs.add_argument("--checkpoint-weights-only", action="store_true",
+                           help="snapshot just the weights instead of a full SavedModel")
+
+    loadCmd = commands.add_parser("load", parents=[loadArgs], help="parse (and cache) a training folder")
+    loadCmd.set_defaults(run=RunLoad)
+
+    trainCmd = commands.add_parser("train", parents=[loadArgs, trainArgs], help="load a training folder and train")
+    trainCmd.set_defaults(run=RunTrain)
+
+    genCmd = commands.add_parser("generate", help="generate samples from a trained model")
+    genCmd.add_argument("--model", metavar="DIR", help="model folder (defaults to the last trained model)")
+    genCmd.add_argument("--out", metavar="DIR", help="folder to save samples to")
+    genCmd.add_argument("--samples", type=int, default=rbm.DEFAULT_SAMPLES)
+    genCmd.add_argument("--tickscale", type=int, default=nn_midi.NNMidiUtility().tickScale, help="MIDI tick scale")
+    genCmd.add_argument("--chunksize", type=int, default=rbm.DEFAULT_GENCHUNK,
+                        help="samples per chunk in bulk generation")
+    genCmd.add_argument("--gen-workers", type=int, default=rbm.DEFAULT_GENWORKERS,
+                        help="processes to write MIDI files with")
+    genCmd.add_argument("--precision", choices=PRECISIONS, default=rbm.DEFAULT_GENPRECISION,
+                        help="weight precision to sample at (reduced precision uses the NumPy engine)")
+    genCmd.set_defaults(run=RunGenerate)
+
+    convertCmd = commands.add_parser("convert", help="export SavedModels' weights to the compact weights format")
+    convertCmd.add_argument("models", nargs="+", metavar="DIR", help="model folders to convert")
+    convertCmd.set_defaults(run=RunConvert)
+
+    return parser
+
+def Main(argv=None):
+    args = BuildParser().parse_args(argv)
+    timing = {"command": args.command}
+
+    if args.profile is not None:
+        Profiler.Enable(memory=args.profile_memory)
+
+    rbmNet = Timed(timing, "setup", MakeNet, args)
+    success = Timed(timing, "total", args.run, args, rbmNet, timing)
+    timing["success"] = bool(success)
+
+    if args.profile is not None:
+        Profiler.Disable()
+        print(Profiler.SummaryTable())
+        Profiler.WriteChromeTrace(args.profile)
+
+    report = json.dumps(timing, sort_keys=True)
+    print(report)
+
+    if args.timing is not None:
+        with open(args.timing, 'w') as timingFile:
+            timingFile.write(report + "\n")
+
+    return 0 if success else 1
+
+#Guarded, since worker processes re-import this script.
+if __name__ == '__main__':
+    sys.exit(Main())
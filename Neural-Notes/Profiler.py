@@ -0,0 +1,198 @@
+'''
+PROFILER.PY
+
+This script provides opt-in timing spans for finding where a slow run spends its time.
+Phases are wrapped with Span (a context manager) or Profiled (a function decorator). Each span records its
+wall time, and optionally its peak Python memory (via tracemalloc).
+
+Nothing is recorded until Enable() is called - until then a span is just a flag check.
+Results can be written out as a Chrome trace (open in chrome://tracing or Perfetto, which also give a flame graph view)
+or printed as a summary table.
+
+Spans are recorded per process, so anything that happens in a worker pool (parallel loading, bulk MIDI writing)
+only shows up as the time the main process spent waiting on it.
+
+DEPENDENCIES:
+
+Tracemalloc - Python memory tracking (only when asked for).
+JSON - trace export.
+'''
+
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+#Whether spans are being recorded. Checked by every span, so keep it a plain module global.
+enabled = False
+trackMemory = False
+
+#Completed spans, as (name, start seconds, duration seconds, thread id, peak bytes or None).
+records = []
+recordLock = threading.Lock()
+localState = threading.local()
+traceStart = 0.0
+
+#Start recording spans. Memory tracking makes every allocation slower, so it's off unless asked for.
+def Enable(memory=False):
+    global enabled, trackMemory, traceStart
+
+    Reset()
+    traceStart = time.perf_counter()
+    trackMemory = memory
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    enabled = True
+
+def Disable():
+    global enabled
+
+    enabled = False
+
+    if trackMemory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def Reset():
+    with recordLock:
+        del records[:]
+
+#Stack of open spans on this thread, as [starting bytes, highest peak seen by finished children].
+def MemoryStack():
+    if not hasattr(localState, "memStack"):
+        localState.memStack = []
+
+    return localState.memStack
+
+'''
+ActiveSpan class.
+One running span - records itself when it exits.
+tracemalloc only keeps a single peak, so it's reset at each span boundary and the peaks of nested spans
+are folded back into their parents by hand.
+'''
+class ActiveSpan:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if trackMemory:
+            current, peak = tracemalloc.get_traced_memory()
+            stack = MemoryStack()
+
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+
+            tracemalloc.reset_peak()
+            stack.append([current, 0])
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        duration = time.perf_counter() - self.start
+        peakBytes = None
+
+        if trackMemory:
+            current, peak = tracemalloc.get_traced_memory()
+            stack = MemoryStack()
+            startBytes, childPeak = stack.pop()
+            peak = max(peak, childPeak)
+
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+
+            tracemalloc.reset_peak()
+            peakBytes = peak - startBytes
+
+        with recordLock:
+            records.append((self.name, self.start - traceStart, duration, threading.get_ident(), peakBytes))
+
+        return False
+
+'''
+NullSpan class.
+What Span hands back while profiling is off - does nothing at all.
+'''
+class NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+#Time a block of code under the given name: "with Profiler.Span('Train.epoch'):"
+def Span(name):
+    if not enabled:
+        return NULL_SPAN
+
+    return ActiveSpan(name)
+
+#Decorator that times every call of a function, named after it (e.g. "RBMNet.Train") unless told otherwise.
+def Profiled(name=None):
+    def Decorate(fn):
+        spanName = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def Wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+
+            with ActiveSpan(spanName):
+                return fn(*args, **kwargs)
+
+        return Wrapper
+
+    return Decorate
+
+#Totals per span name: {name: [calls, total seconds, longest seconds, peak bytes or None]}.
+def Summary():
+    totals = {}
+
+    with recordLock:
+        for name, start, duration, tid, peakBytes in records:
+            entry = totals.setdefault(name, [0, 0.0, 0.0, None])
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+
+            if peakBytes is not None:
+                entry[3] = max(entry[3] or 0, peakBytes)
+
+    return totals
+
+#Summary as a text table, slowest phases first.
+def SummaryTable():
+    lines = ["{:<36} {:>8} {:>11} {:>11} {:>11} {:>10}".format(
+        "Span", "Calls", "Total (s)", "Mean (ms)", "Max (ms)", "Peak (MB)")]
+
+    for name, (calls, total, longest, peakBytes) in sorted(Summary().items(), key=lambda item: -item[1][1]):
+        lines.append("{:<36} {:>8} {:>11.3f} {:>11.3f} {:>11.3f} {:>10}".format(
+            name, calls, total, 1000 * total / calls, 1000 * longest,
+            "-" if peakBytes is None else "{:.1f}".format(peakBytes / (1024 * 1024))))
+
+    return "\n".join(lines)
+
+#Write every recorded span out in Chrome's trace event format.
+def WriteChromeTrace(filename):
+    events = []
+    pid = os.getpid()
+
+    with recordLock:
+        for name, start, duration, tid, peakBytes in records:
+            event = {"name": name, "cat": name.split(".")[0], "ph": "X", "pid": pid, "tid": tid,
+                     "ts": round(start * 1e6, 3), "dur": round(duration * 1e6, 3)}
+
+            if peakBytes is not None:
+                event["args"] = {"peak_bytes": peakBytes}
+
+            events.append(event)
+
+    with open(filename, 'w') as traceFile:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, traceFile)
@@ -5,24 +5,43 @@ This script manages training of the neural net.
 
 DEPENDENCIES:
 
-Tensorflow - machine learning library.
+Tensorflow - machine learning library (imported on first use, see ImportTensorflow).
 Glob and Shutil - directory utilities.
+Collections - ordered dictionary for the resident model cache.
+Concurrent.futures - process pool for loading training data.
+Multiprocessing - start method for the process pools.
 Tqdm - console progress bars.
 Numpy - math library.
 OS - directory path/tensorflow logging.
+Time - training throughput reporting.
+Threading - cancellation flag for long-running jobs.
+FVCache - on-disk cache of parsed feature vectors.
+Corpus - bit-packed training set.
+RBMNumpy - NumPy version of the RBM, for training/generating without Tensorflow.
+Profiler - optional timing spans around each phase.
 '''
 
-import tensorflow as tf
-from tensorflow.python.ops import control_flow_ops
 import glob
+import collections
+import concurrent.futures
+import multiprocessing
 import shutil
 from tqdm import tqdm
 import numpy as num
 import os
+import time
+import threading
+
+from Corpus import Corpus, CorpusWriter, CORPUS_EXT
+from FVCache import FVCache, LoadFeatureVector
+from MidiWrapper import WriteSampleChunk
+from RBMNumpy import NumpyRBM, ReducedRBM, WEIGHTS_FILE
+from Profiler import Profiled, Span
 
 #Default paths for model/sample saving.
 MODEL_SAVE_LOC = os.path.dirname(os.path.realpath(__file__)) + '/data/tmp_model'
 SAMPLE_LOC = os.path.dirname(os.path.realpath(__file__)) + '/sampleout'
+CHECKPOINT_LOC = os.path.dirname(os.path.realpath(__file__)) + '/data/checkpoints'
 
 #Starting values for neural net parameters.
 #Yes, some of these are changed by the UI.
@@ -33,6 +52,39 @@ DEFAULT_EPOCHS = 75
 DEFAULT_BATCHSIZE = 100
 DEFAULT_LEARNRATE = 0.005
 DEFAULT_SAMPLES = 5
+DEFAULT_LOADWORKERS = os.cpu_count() or 1
+DEFAULT_STEPSPERRUN = 1
+DEFAULT_MODELCACHE = 4
+DEFAULT_GENCHUNK = 1000
+DEFAULT_GENWORKERS = os.cpu_count() or 1
+DEFAULT_GENPRECISION = "float32"
+DEFAULT_WINDOWHOP = 0
+DEFAULT_TRANSPOSE = 0
+
+#Worker processes are spawned rather than forked. Pools are started from the background job thread (and can sit
+#alongside Tensorflow's own threads), and a forked child can deadlock on a lock another thread happened to be holding.
+POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+#Tensorflow takes seconds to import, so we hold off until training/generation actually needs it.
+#Until then, these stay None - anything that builds a graph should call ImportTensorflow first.
+tf = None
+control_flow_ops = None
+
+def ImportTensorflow():
+    global tf, control_flow_ops
+
+    if tf is None:
+        os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+        importStart = time.perf_counter()
+        import tensorflow
+        from tensorflow.python.ops import control_flow_ops as tfControlFlow
+        tf = tensorflow
+        control_flow_ops = tfControlFlow
+
+        print("Loaded Tensorflow in {:.2f}s".format(time.perf_counter() - importStart))
+
+    return tf
 
 #Probabilistic random tensor sampling.
 def ProbSample(p):
@@ -57,18 +109,68 @@ def Gibbs(k, x, wMatrix, hBias, vBias):
     x_sample = tf.stop_gradient(x_sample)
     return x_sample
 
+#Modification times of the files making up a saved model, used to tell when a resident copy is stale.
+def ModelStamp(modelDir):
+    stamp = []
+
+    for modelFile in ("saved_model.pb", "variables/variables.index", WEIGHTS_FILE):
+        modelPath = os.path.join(modelDir, modelFile)
+        stamp.append(os.path.getmtime(modelPath) if os.path.isfile(modelPath) else None)
+
+    return tuple(stamp)
+
+'''
+ResidentModel class.
+A Tensorflow model kept in memory between Generate calls - its own graph and session, plus a ready-made sampling op.
+Has the same Sample interface as NumpyRBM, so Generate doesn't care which one it gets.
+'''
+class ResidentModel:
+
+    def __init__(self, session, notedata, sampleOp, timesteps, vNodes):
+        self.session = session
+        self.notedata = notedata
+        self.sampleOp = sampleOp
+        self.timesteps = timesteps
+        self.vNodes = vNodes
+
+    def Sample(self, numSamples):
+        return self.session.run(self.sampleOp, feed_dict={self.notedata: num.zeros((numSamples, self.vNodes))})
+
+    def Close(self):
+        self.session.close()
+
 class RBMNet:
 
     def __init__(self, midiUtil):
         self.midi = midiUtil
-        self.trainDataset = []
+        self.trainDataset = Corpus(2 * midiUtil.notespan)
+        self.fvCache = FVCache()
+        self.useFVCache = True
+        self.corpusFile = None
+        self.loadWorkers = DEFAULT_LOADWORKERS
+        self.useDataset = False
+        self.stepsPerRun = DEFAULT_STEPSPERRUN
+        self.useNumpy = False
+        self.modelCache = collections.OrderedDict()
+        self.modelCacheSize = DEFAULT_MODELCACHE
+        self.genChunkSize = DEFAULT_GENCHUNK
+        self.genWorkers = DEFAULT_GENWORKERS
+        self.genPrecision = DEFAULT_GENPRECISION
+        self.windowHop = DEFAULT_WINDOWHOP
+        self.transposeRange = DEFAULT_TRANSPOSE
+        self.progressCallback = None
+        self.checkpointEpochs = []
+        self.checkpointDir = CHECKPOINT_LOC
+        self.checkpointWeightsOnly = False
+        self.resumeDir = None
+        self.trainStats = {}
+        self.cancelEvent = threading.Event()
         self.InitNNParameters()
-
-        os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
         return
 
+    #Set up the network's parameters from the current defaults.
+    #This is cheap - the Tensorflow graph itself isn't built until BuildGraph is called (by Train).
     def InitNNParameters(self):
-        tf.reset_default_graph()
 
         #Parameters constraining qualities of the training/generated samples.
         #Span of notes/MIDI timesteps to consider (affects both training/generation), and number of samples to generate.
@@ -76,7 +178,6 @@ class RBMNet:
         #These parameters also control the size of our visible layer.
         self.notespan = self.midi.notespan
         self.timesteps = DEFAULT_TIMESTEPS
-        self.tfTimesteps = tf.Variable(DEFAULT_TIMESTEPS, name="timesteps")
         self.genSample = DEFAULT_SAMPLES
 
         #Size of our hidden and visible layers.
@@ -87,7 +188,16 @@ class RBMNet:
         #Epochs/learn rate are customizable from the UI.
         self.epochs = DEFAULT_EPOCHS
         self.batchSize = DEFAULT_BATCHSIZE
-        self.learnRate = tf.constant(DEFAULT_LEARNRATE, tf.float32)
+        self.learnRate = DEFAULT_LEARNRATE
+
+    #Build the Tensorflow graph for training, using the parameters set up in InitNNParameters.
+    @Profiled()
+    def BuildGraph(self):
+        ImportTensorflow()
+        tf.reset_default_graph()
+
+        self.vNodes = 2 * self.notespan * self.timesteps
+        self.tfTimesteps = tf.Variable(self.timesteps, name="timesteps")
 
         #Initialize our weight matrix and bias vectors.
         #Weight matrix starts as random values, biases start as zeroes.
@@ -106,75 +216,206 @@ class RBMNet:
 
         #Tensorflow "placeholder" variable - this is our "feature vector" and will be fed with training data.
         self.notedata = tf.placeholder(tf.float32, [None, self.vNodes])
+        self.trainUpdate = self.BuildTrainUpdate(self.notedata)
+
+    #Build a single contrastive divergence (CD-1) update, driven by a batch of visible layer data.
+    #The batch can be our feed_dict placeholder or the output of a tf.data iterator.
+    #params is the (weights, visible bias, hidden bias) to compute the update from - the variables themselves
+    #unless given, but BuildTrainLoop hands in fresh reads of them.
+    def BuildTrainUpdate(self, notedata, params=None):
+        wMatrix, vBias, hBias = params or (self.wMatrix, self.vBias, self.hBias)
+
         #This variable will be used to sample from our network while it is training.
-        self.note_sample = Gibbs(k=1, x=self.notedata, wMatrix=self.wMatrix,
-                                 hBias=self.hBias, vBias=self.vBias)
+        note_sample = Gibbs(k=1, x=notedata, wMatrix=wMatrix,
+                            hBias=hBias, vBias=vBias)
 
         #Hidden layer placeholder data/sample.
-        self.hdata = ProbSample(tf.sigmoid(tf.matmul(self.notedata, self.wMatrix) + self.hBias))
-        self.h_sample = ProbSample(tf.sigmoid(tf.matmul(self.note_sample, self.wMatrix) + self.hBias))
+        hdata = ProbSample(tf.sigmoid(tf.matmul(notedata, wMatrix) + hBias))
+        h_sample = ProbSample(tf.sigmoid(tf.matmul(note_sample, wMatrix) + hBias))
 
         #Used for Tensorflow to keep track of the shape (dimensionality) of the network.
-        self.elemShape = tf.cast(tf.shape(self.notedata)[0], tf.float32)
+        elemShape = tf.cast(tf.shape(notedata)[0], tf.float32)
+        learnRate = tf.constant(self.learnRate, tf.float32)
 
         #This part of our training routine will adjust the matrix weights.
         #Note the use of tf.subtract, which is essentially our cost function.
-        self.wAdjust = tf.multiply(self.learnRate / self.elemShape,
-                                   tf.subtract(tf.matmul(tf.transpose(self.notedata), self.hdata),
-                                               tf.matmul(tf.transpose(self.note_sample), self.h_sample)))
+        wAdjust = tf.multiply(learnRate / elemShape,
+                              tf.subtract(tf.matmul(tf.transpose(notedata), hdata),
+                                          tf.matmul(tf.transpose(note_sample), h_sample)))
 
         #The following two operations adjust the biases in a similar fashion to above.
         #In essence, our "cost function" is attempting to minimize the difference between the data given to the
         #network (the actual visible layer) and the data reconstructed by the network (the estimate of the visible
         #layer obtained via Gibbs sampling).
-        self.vBAdjust = tf.multiply(self.learnRate / self.elemShape,
-                                    tf.reduce_sum(tf.subtract(self.notedata, self.note_sample), 0, True))
-        self.hBAdjust = tf.multiply(self.learnRate / self.elemShape,
-                                    tf.reduce_sum(tf.subtract(self.hdata, self.h_sample), 0, True))
+        vBAdjust = tf.multiply(learnRate / elemShape,
+                               tf.reduce_sum(tf.subtract(notedata, note_sample), 0, True))
+        hBAdjust = tf.multiply(learnRate / elemShape,
+                               tf.reduce_sum(tf.subtract(hdata, h_sample), 0, True))
 
         #This defines a training update routine in Tensorflow.
         #Adjust weights and biases according to calculated "nudges".
         #We will trigger this repeatedly during the training session.
-        self.trainUpdate = [self.wMatrix.assign_add(self.wAdjust),
-                            self.vBias.assign_add(self.vBAdjust),
-                            self.hBias.assign_add(self.hBAdjust)]
+        return [self.wMatrix.assign_add(wAdjust),
+                self.vBias.assign_add(vBAdjust),
+                self.hBias.assign_add(hBAdjust)]
+
+    #Run several CD-1 updates inside a single graph execution, using a while loop like Gibbs does.
+    #nextBatch is called while building the loop body, so every iteration pulls a fresh batch.
+    def BuildTrainLoop(self, nextBatch, numSteps):
+
+        def TrainStep(count):
+            #Read the weights and biases afresh every iteration. Used directly, the variables would be read once
+            #(as the loop starts), and every step would be computed from those same stale values.
+            #count only arrives once the previous iteration's updates have landed, so these reads wait on them.
+            with tf.control_dependencies([count]):
+                params = (self.wMatrix.read_value(), self.vBias.read_value(), self.hBias.read_value())
+
+            #Only move on to the next iteration once this one's weight/bias updates have landed.
+            with tf.control_dependencies(self.BuildTrainUpdate(nextBatch(), params)):
+                return count + 1
+
+        ct = tf.constant(0)
+        return control_flow_ops.while_loop(lambda count: count < numSteps, TrainStep, [ct], parallel_iterations=1)
 
     #Load training data.
+    #Either a folder of MIDI files, or a corpus file built from one earlier (which is mapped as-is).
+    #If corpusFile is set, songs from a folder are streamed into that file as they're parsed, rather than held in memory.
+    @Profiled()
     def LoadTrainingSet(self, directory):
 
         #Initialize blank training set.
-        self.trainDataset = []
+        self.trainDataset = Corpus(2 * self.midi.notespan)
+
+        if directory is not None and directory.endswith(CORPUS_EXT) and os.path.isfile(directory):
+            return self.OpenCorpus(directory)
 
         if not(directory is not None and directory and os.path.isdir(directory)):
             print("Can't load training data - no valid directory specified!")
             return False
 
         #Use Glob to grab all the MIDI files in the chosen directory.
-        fileset = glob.glob("{}/*.mid*".format(directory))
+        #Sorted so the training set comes out in the same order on every platform.
+        fileset = sorted(glob.glob("{}/*.mid*".format(directory)))
 
-        self.midi.maxLength = DEFAULT_TIMESTEPS * 3;
+        cache = self.fvCache if self.useFVCache else None
 
         #Parse every file and convert it to a feature vector.
-        for midifile in tqdm(fileset):
-            try:
-                fv = num.array(self.midi.MIDItoFV(midifile))
+        #With more than one worker, files are parsed in a process pool.
+        #Results are passed on in file order (see AddLoaded), so the dataset order doesn't depend on which file
+        #finishes first - and only results waiting on an earlier file are held on to.
+        songs = []
+        writer = None
+        ready = {}
+        nextIdx = 0
+
+        if self.corpusFile is not None:
+            writer = CorpusWriter(self.corpusFile, 2 * self.midi.notespan)
+            addSong = writer.Append
+        else:
+            addSong = songs.append
+
+        #Anything going wrong from here on (a worker dying, say) mustn't leave a half-written corpus file behind.
+        try:
+            if self.loadWorkers > 1 and len(fileset) > 1:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.loadWorkers, len(fileset)),
+                                                            mp_context=POOL_CONTEXT) as pool:
+                    futures = {pool.submit(LoadFeatureVector, midifile, self.midi, cache): i
+                               for i, midifile in enumerate(fileset)}
+
+                    completed = tqdm(concurrent.futures.as_completed(futures), total=len(futures))
+
+                    for done, future in enumerate(completed):
+                        ready[futures[future]] = future.result()
+                        nextIdx = self.AddLoaded(ready, nextIdx, addSong)
+                        self.ReportProgress("Loading", done + 1, len(fileset))
+
+                        #Drop whatever hasn't started yet - the pool waits for running files on the way out.
+                        if self.IsCancelled():
+                            for pending in futures:
+                                pending.cancel()
+                            break
+            else:
+                for i, midifile in enumerate(tqdm(fileset)):
+                    if self.IsCancelled():
+                        break
+
+                    ready[i] = LoadFeatureVector(midifile, self.midi, cache)
+                    nextIdx = self.AddLoaded(ready, nextIdx, addSong)
+                    self.ReportProgress("Loading", i + 1, len(fileset))
+
+            if self.IsCancelled():
+                if writer is not None:
+                    writer.Abort()
+
+                print("Loading cancelled.")
+                return False
+
+            #Pack every song that's long enough into one bit-packed piano roll.
+            if writer is not None:
+                self.trainDataset = writer.Close()
+                print("Training set stored in " + self.corpusFile)
+            else:
+                self.trainDataset = Corpus.FromSongs(songs, 2 * self.midi.notespan)
+        except BaseException:
+            if writer is not None:
+                writer.Abort()
+
+            raise
+
+        #Keep the feature vector cache within its size budget.
+        if self.useFVCache:
+            self.fvCache.Evict()
+
+        print("Loaded {} MIDI files for training ({} frames, {:.1f}MB packed).".format(
+            len(self.trainDataset), self.trainDataset.NumFrames(), self.trainDataset.NBytes() / (1024 * 1024)))
+
+        return True
 
-                if num.array(fv).shape[0] > DEFAULT_TIMESTEPS * 2:
-                    self.trainDataset.append(fv)
-            except Exception as e:
+    #Hand loaded feature vectors on to addSong in file order, as soon as every file before them is done.
+    #Files that failed to parse are reported, and empty songs (nothing past the leading silence) are dropped.
+    #Returns the index of the next file we're waiting on.
+    def AddLoaded(self, ready, nextIdx, addSong):
+        while nextIdx in ready:
+            fv, e = ready.pop(nextIdx)
+
+            if e is not None:
                 print(e)
+            elif fv.shape[0] > 1:
+                addSong(fv)
+
+            nextIdx += 1
+
+        return nextIdx
+
+    #Train straight from a corpus file, without re-reading any MIDI files.
+    def OpenCorpus(self, filename):
+        try:
+            corpus = Corpus.Open(filename)
+        except (OSError, ValueError) as e:
+            print("Can't load training data - " + str(e))
+            return False
 
-        print("Loaded {} MIDI files for training.".format(len(self.trainDataset)))
+        if corpus.width != 2 * self.midi.notespan:
+            print("Can't load training data - {} has {} notes per frame, expected {}.".format(
+                filename, corpus.width // 2, self.midi.notespan))
+            return False
 
+        self.trainDataset = corpus
+        print("Opened {} songs for training ({} frames) from {}.".format(len(corpus), corpus.NumFrames(), filename))
         return True
 
     #Train the network!
+    @Profiled()
     def Train(self, event, saveDir):
 
         if not len(self.trainDataset) > 0:
             print("Can't train without any data!")
             return False
 
+        if self.windowHop < 0:
+            print("Can't train with a negative window hop ({})!".format(self.windowHop))
+            return False
+
         #Sort out our persistence strategy.
         #Default to save in the temporary directory (caches last trained model).
         modelSaveLoc = MODEL_SAVE_LOC
@@ -183,60 +424,348 @@ class RBMNet:
         #If a valid alternate directory is provided, use that.
         if saveDir is not None and saveDir and os.path.isdir(saveDir) and os.listdir(saveDir) == []:
             modelSaveLoc = saveDir
-            os.rmdir(saveDir)
             saveTmp = True
             print("Model will be saved to " + modelSaveLoc)
 
-        #Remove the existing cached model.
-        #Tensorflow won't let us save to an existing directory.
-        shutil.rmtree(MODEL_SAVE_LOC)
-        netBuilder = tf.saved_model.builder.SavedModelBuilder(modelSaveLoc)
+        #Optionally pick up where an existing model left off, rather than starting from random weights.
+        #Its hidden layer size wins over the configured one.
+        resumeModel = None
+
+        if self.resumeDir is not None:
+            resumeModel = self.LoadResumeModel(self.resumeDir)
 
-        #If an alternate is provided, we still want to write to the tmp cache.
-        if saveTmp:
-            tmpNetBuilder = tf.saved_model.builder.SavedModelBuilder(MODEL_SAVE_LOC)
+            if resumeModel is None:
+                return False
+
+            self.hNodes = resumeModel.hNodes
+
+        #Every song is chopped into timesteps-long windows - each one is a training example for the visible layer.
+        #Songs are stored whole, so this works for any number of timesteps - only the window start frames are
+        #worked out up front, and the windows themselves are expanded per minibatch.
+        #As ever, songs need to be more than two windows long to be trained on.
+        #Windows start every windowHop frames - anything less than timesteps (0 means timesteps) gives overlapping
+        #windows, and so more training examples from the same songs.
+        windowStarts = self.trainDataset.WindowStarts(self.timesteps, 2 * self.timesteps + 1, self.windowHop)
+
+        if len(windowStarts) == 0:
+            print("No songs are long enough to train on with {} timesteps!".format(self.timesteps))
+            return False
+
+        if self.useNumpy:
+            return self.TrainNumpy(windowStarts, modelSaveLoc, saveTmp, resumeModel)
+
+        self.BuildGraph()
+
+        stepsPerEpoch = -(-len(windowStarts) // self.batchSize)
+
+        #Updates per session.run - anything other than 1 loops inside the graph, and 0 means a whole epoch.
+        runSteps = stepsPerEpoch if self.stepsPerRun <= 0 else self.stepsPerRun
+        inGraphLoop = self.stepsPerRun != 1
+
+        #Optionally stream batches through a tf.data pipeline instead of feed_dict.
+        #Shuffling and batching happen inside the runtime, and the next batch is prefetched while the
+        #current update is running. The windows are fed in once (as bytes, cast per batch) when the iterator
+        #is initialized. The in-graph training loop always pulls its batches this way.
+        #A memory-mapped corpus is streamed through a generator instead, a freshly shuffled epoch at a time,
+        #so the whole training set is never pulled into memory at once. Likewise with overlapping windows,
+        #which would otherwise be copied out several times over, and with transposition, which differs every epoch.
+        overlapping = 0 < self.windowHop < self.timesteps
+        streamed = self.trainDataset.IsMapped() or overlapping or self.transposeRange > 0
+        feedMatrix = (self.useDataset or inGraphLoop) and not streamed
+
+        if feedMatrix:
+            trainMatrix = self.trainDataset.Windows(windowStarts, self.timesteps, num.uint8)
+            trainInput = tf.placeholder(tf.uint8, trainMatrix.shape)
+            dataset = tf.data.Dataset.from_tensor_slices(trainInput)
+            dataset = dataset.shuffle(len(trainMatrix)).batch(self.batchSize)
+            dataset = dataset.map(lambda batch: tf.cast(batch, tf.float32)).repeat().prefetch(1)
+
+        elif self.useDataset or inGraphLoop:
+            dataset = tf.data.Dataset.from_generator(
+                lambda: self.trainDataset.Batches(windowStarts, self.timesteps, self.batchSize,
+                                                  transposeRange=self.transposeRange),
+                tf.float32, tf.TensorShape([None, self.vNodes]))
+            dataset = dataset.repeat().prefetch(1)
+
+        if self.useDataset or inGraphLoop:
+            trainIterator = dataset.make_initializable_iterator()
+
+            if inGraphLoop:
+                numSteps = tf.placeholder(tf.int32, [])
+                datasetUpdate = self.BuildTrainLoop(trainIterator.get_next, numSteps)
+            else:
+                datasetUpdate = self.BuildTrainUpdate(trainIterator.get_next())
 
         with tf.Session() as session:
 
             session.run(tf.global_variables_initializer())
 
+            if resumeModel is not None:
+                self.wMatrix.load(resumeModel.wMatrix, session)
+                self.vBias.load(resumeModel.vBias, session)
+                self.hBias.load(resumeModel.hBias, session)
+
+            if feedMatrix:
+                session.run(trainIterator.initializer, feed_dict={trainInput: trainMatrix})
+            elif self.useDataset or inGraphLoop:
+                session.run(trainIterator.initializer)
+
+            startTime = time.perf_counter()
+
             #Epoch count is configured earlier.
             #TQDM will let us monitor progression in the console.
             for epoch in tqdm(range(self.epochs)):
 
-                #For every training FV (song) we have...
-                for tData in self.trainDataset:
-                    #Convert/reshape the FV to work with Tensorflow.
-                    tData = num.array(tData)
-                    tData = tData[:int(num.floor(tData.shape[0] // self.timesteps) * self.timesteps)]
-                    tData = num.reshape(tData, [tData.shape[0] // self.timesteps, tData.shape[1] * self.timesteps])
+                if self.IsCancelled():
+                    break
+
+                with Span("RBMNet.Train.epoch"):
+
+                    #Batches are shuffled per epoch and never span two epochs, so this is one full pass.
+                    #In-graph, we only come back to Python every runSteps updates.
+                    if inGraphLoop:
+                        for i in range(0, stepsPerEpoch, runSteps):
+                            session.run(datasetUpdate, feed_dict={numSteps: min(runSteps, stepsPerEpoch - i)})
 
-                    #Run through the current example, chunking the data according to our batch size.
-                    for i in range(1, len(tData), self.batchSize):
-                        tr_x = tData[i:i + self.batchSize]
-                        session.run(self.trainUpdate, feed_dict={self.notedata: tr_x})
+                    elif self.useDataset:
+                        for i in range(stepsPerEpoch):
+                            session.run(datasetUpdate)
+
+                    #Shuffle windows across songs, then walk through them in minibatches.
+                    else:
+                        for tr_x in self.trainDataset.Batches(windowStarts, self.timesteps, self.batchSize,
+                                                              transposeRange=self.transposeRange):
+                            session.run(self.trainUpdate, feed_dict={self.notedata: tr_x})
+
+                if epoch + 1 in self.checkpointEpochs:
+                    self.SaveCheckpoint(epoch + 1, session=session)
+
+                self.ReportProgress("Training", epoch + 1, self.epochs)
+
+            #Leave any previously saved model alone if we were cancelled partway.
+            if self.IsCancelled():
+                print("Training cancelled.")
+                return False
+
+            #Report throughput, so the two input paths can be compared.
+            trainTime = time.perf_counter() - startTime
+            self.trainStats = {"steps": stepsPerEpoch * self.epochs, "seconds": trainTime}
+            print("Trained {} steps in {:.2f}s ({:.1f} steps/sec, {} input, {} steps per run)".format(
+                stepsPerEpoch * self.epochs, trainTime, stepsPerEpoch * self.epochs / max(trainTime, 1e-9),
+                "tf.data" if self.useDataset or inGraphLoop else "feed_dict", runSteps if inGraphLoop else 1))
+
+            #Tensorflow won't let us save to an existing directory.
+            self.ClearModelDirs(modelSaveLoc, saveTmp)
+            netBuilder = tf.saved_model.builder.SavedModelBuilder(modelSaveLoc)
+
+            #If an alternate is provided, we still want to write to the tmp cache.
+            if saveTmp:
+                tmpNetBuilder = tf.saved_model.builder.SavedModelBuilder(MODEL_SAVE_LOC)
 
             #Prep our builders to save the model.
-            netBuilder.add_meta_graph_and_variables(session, ["RBMNet"])
+            with Span("RBMNet.Train.save"):
+                netBuilder.add_meta_graph_and_variables(session, ["RBMNet"])
+
+                if saveTmp:
+                    tmpNetBuilder.add_meta_graph_and_variables(session, ["RBMNet"])
+
+        #Save and/or cache our model.
+        with Span("RBMNet.Train.save"):
+            netBuilder.save()
 
             if saveTmp:
-                tmpNetBuilder.add_meta_graph_and_variables(session, ["RBMNet"])
+                tmpNetBuilder.save()
+
+        print("Model stored in " + modelSaveLoc)
+        return True
+
+    #Train with the NumPy engine instead of Tensorflow.
+    #Same CD-1 update and batching, but only the weights are stored rather than a SavedModel.
+    @Profiled()
+    def TrainNumpy(self, windowStarts, modelSaveLoc, saveTmp, resumeModel=None):
+
+        engine = resumeModel if resumeModel is not None else NumpyRBM(self.notespan, self.timesteps, self.hNodes)
+        stepsPerEpoch = -(-len(windowStarts) // self.batchSize)
+        startTime = time.perf_counter()
+
+        for epoch in tqdm(range(self.epochs)):
+            if self.IsCancelled():
+                print("Training cancelled.")
+                return False
+
+            engine.TrainEpoch(self.trainDataset.Batches(windowStarts, self.timesteps, self.batchSize, engine.rng,
+                                                        self.transposeRange), self.learnRate)
+
+            if epoch + 1 in self.checkpointEpochs:
+                self.SaveCheckpoint(epoch + 1, engine=engine)
+
+            self.ReportProgress("Training", epoch + 1, self.epochs)
+
+        trainTime = time.perf_counter() - startTime
+        self.trainStats = {"steps": stepsPerEpoch * self.epochs, "seconds": trainTime}
+        print("Trained {} steps in {:.2f}s ({:.1f} steps/sec, NumPy engine)".format(
+            stepsPerEpoch * self.epochs, trainTime, stepsPerEpoch * self.epochs / max(trainTime, 1e-9)))
 
         #Save and/or cache our model.
-        netBuilder.save()
+        self.ClearModelDirs(modelSaveLoc, saveTmp)
+
+        with Span("RBMNet.Train.save"):
+            engine.Save(modelSaveLoc)
 
-        if saveTmp:
-            tmpNetBuilder.save()
+            if saveTmp:
+                engine.Save(MODEL_SAVE_LOC)
 
         print("Model stored in " + modelSaveLoc)
         return True
 
+    #Snapshot the model partway through training, into checkpointDir/<epoch>epochs.
+    #That way one long run can stand in for a whole sweep of runs at different epoch counts.
+    #Snapshots are full SavedModels, or just the weights (in the NumPy engine's format) if checkpointWeightsOnly is set.
+    @Profiled()
+    def SaveCheckpoint(self, epoch, session=None, engine=None):
+
+        checkpointLoc = os.path.join(self.checkpointDir, "{}epochs".format(epoch))
+
+        #Like any other model, snapshots never go in a folder that already has something in it -
+        #a snapshot from an earlier run is left alone, and this one skipped.
+        if os.path.isdir(checkpointLoc) and os.listdir(checkpointLoc):
+            print("Skipped checkpoint ({} epochs) - {} isn't empty".format(epoch, checkpointLoc))
+            return False
+
+        #Tensorflow won't save into an existing folder, even an empty one.
+        if os.path.isdir(checkpointLoc):
+            os.rmdir(checkpointLoc)
+
+        if engine is None and not self.checkpointWeightsOnly:
+            checkpointBuilder = tf.saved_model.builder.SavedModelBuilder(checkpointLoc)
+            checkpointBuilder.add_meta_graph_and_variables(session, ["RBMNet"])
+            checkpointBuilder.save()
+        else:
+            if engine is None:
+                wMatrix, vBias, hBias = session.run([self.wMatrix, self.vBias, self.hBias])
+                engine = NumpyRBM.FromWeights(self.notespan, wMatrix, vBias, hBias, self.timesteps)
+
+            engine.Save(checkpointLoc)
+
+        print("Checkpoint ({} epochs) stored in {}".format(epoch, checkpointLoc))
+        return True
+
+    #Read the weights of a model we're resuming training from, as a NumpyRBM.
+    #Uses the NumPy weights if the directory has them, otherwise restores its SavedModel.
+    #Returns None if there's no model there, or it doesn't fit the current timesteps/note span.
+    @Profiled()
+    def LoadResumeModel(self, modelDir):
+
+        haveSavedModel = os.path.isfile(modelDir + "/saved_model.pb")
+
+        if not haveSavedModel and not NumpyRBM.IsStored(modelDir):
+            print("No model found in " + modelDir)
+            return None
+
+        try:
+            if NumpyRBM.IsStored(modelDir):
+                model = NumpyRBM.Load(modelDir, self.notespan, copy=True)
+            else:
+                #Restore into a throwaway graph - Train builds its own.
+                ImportTensorflow()
+                timesteps = self.timesteps
+
+                with tf.Graph().as_default(), tf.Session() as session:
+                    self.LoadSavedModel(session, modelDir)
+                    wMatrix, vBias, hBias = session.run([self.wMatrix, self.vBias, self.hBias])
+
+                model = NumpyRBM.FromWeights(self.notespan, wMatrix, vBias, hBias, self.timesteps)
+                self.timesteps = timesteps
+                self.vNodes = 2 * self.notespan * timesteps
+
+        #A different note span gives a weight matrix of the wrong size.
+        except ValueError as e:
+            print("Can't resume from {}: {}".format(modelDir, e))
+            return None
+
+        if model.timesteps != self.timesteps:
+            print("Can't resume from {}: it was trained with {} timesteps, not {}.".format(
+                modelDir, model.timesteps, self.timesteps))
+            return None
+
+        print("Resuming training from " + modelDir)
+        return model
+
+    #Clear out the directories a freshly trained model is about to be saved to.
+    #Only called once training has finished, so a cancelled or failed run leaves the last model in place.
+    @Profiled()
+    def ClearModelDirs(self, modelSaveLoc, saveTmp):
+
+        #Resident models may have weights files mapped, which Windows won't delete - and they're about to be stale anyway.
+        self.ClearModelCache()
+
+        #Remove the existing cached model.
+        if os.path.isdir(MODEL_SAVE_LOC):
+            shutil.rmtree(MODEL_SAVE_LOC)
+
+        #The alternate directory was checked to be empty when training started.
+        if saveTmp and os.path.isdir(modelSaveLoc):
+            os.rmdir(modelSaveLoc)
+
+    #Report progress to whoever's listening (the UI's background task runner, usually).
+    def ReportProgress(self, stage, done, total):
+        if self.progressCallback is not None:
+            self.progressCallback(stage, done, total)
+
+    #Long-running jobs check this between steps, and wind down early if it's set.
+    def IsCancelled(self):
+        return self.cancelEvent.is_set()
+
     #Check to see if a cached model is available.
     def IsTmpModelStored(self):
         modelLoadCheck = MODEL_SAVE_LOC + "/saved_model.pb"
-        return os.path.isfile(modelLoadCheck)
+        return os.path.isfile(modelLoadCheck) or NumpyRBM.IsStored(MODEL_SAVE_LOC)
+
+    #Restore a SavedModel into the given session, and point our variable references at it.
+    @Profiled()
+    def LoadSavedModel(self, session, modelLoadLoc):
+
+        session.run(tf.global_variables_initializer())
+
+        #Restore our graph state.
+        tf.saved_model.loader.load(session, ["RBMNet"], modelLoadLoc)
+
+        #To my knowledge, this really is the best way to reinitialize our Tensorflow variable references. Sad!
+        for v in tf.global_variables():
+            if "wMatrix" in v.name:
+                self.wMatrix = v
+            elif "vBias" in v.name:
+                self.vBias = v
+            elif "hBias" in v.name:
+                self.hBias = v
+            elif "timesteps" in v.name:
+                self.tfTimesteps = v
+
+        self.timesteps = session.run(self.tfTimesteps)
+        self.vNodes = 2 * self.notespan * self.timesteps
+
+    #Write a SavedModel's weights out in the NumPy engine's format (see RBMNumpy.WriteWeightsFile), alongside the original.
+    #Lets models trained with Tensorflow be used for generation without it - and loading them is just a memory map.
+    def ExportNumpyWeights(self, modelDir):
+
+        if not os.path.isfile(modelDir + "/saved_model.pb"):
+            print("No model found in " + modelDir)
+            return False
+
+        ImportTensorflow()
+        tf.reset_default_graph()
+
+        with tf.Session() as session:
+            self.LoadSavedModel(session, modelDir)
+            wMatrix, vBias, hBias = session.run([self.wMatrix, self.vBias, self.hBias])
+
+        NumpyRBM.FromWeights(self.notespan, wMatrix, vBias, hBias, self.timesteps).Save(modelDir)
+
+        print("Exported NumPy weights to " + modelDir)
+        return True
 
     #Load a model from saved state/cache and generate new music.
+    @Profiled()
     def Generate(self, event, loadDir, saveDir):
 
         #Initialize our loading directory.
@@ -251,50 +780,164 @@ class RBMNet:
             modelLoadLoc = loadDir
 
         modelLoadCheck = modelLoadLoc + "/saved_model.pb"
+        haveSavedModel = os.path.isfile(modelLoadCheck)
 
         #Check to make sure the model we're attempting to load is there.
-        if not os.path.isfile(modelLoadCheck):
+        if not haveSavedModel and not NumpyRBM.IsStored(modelLoadLoc):
             print("Can't generate with no network available!")
             return False
 
+        #Use the NumPy engine if asked to (and it has weights to work with), or if it's all we've got.
+        #Reduced precision sampling is only done by the NumPy engine.
+        reduced = self.genPrecision != "float32"
+        useNumpy = NumpyRBM.IsStored(modelLoadLoc) and (self.useNumpy or not haveSavedModel or reduced)
+
+        if reduced and not useNumpy:
+            print("No weights file in " + modelLoadLoc + " for {} sampling (see NeuralNotesCLI.py convert) - "
+                  "using float32.".format(self.genPrecision))
+        model = self.GetResidentModel(modelLoadLoc, useNumpy)
+
+        self.timesteps = model.timesteps
+        self.vNodes = model.vNodes
+
+        #Big runs go through bulk generation, so we never hold every sample in memory at once.
+        if self.genSample > self.genChunkSize:
+            return self.GenerateBulk(model, self.genSample, sampleSaveLoc)
+
+        #Sample our network.
+        #This will generate a multidimensional array containing reconstructed visible layer data (i.e., songs)
+        #for every sample we want to generate (the number of samples is customizable in the UI).
+        with Span("RBMNet.Generate.sample"):
+            sample = model.Sample(self.genSample)
+
+        self.WriteSamples(sample, sampleSaveLoc)
+        return True
+
+    #Generate a large number of samples from a loaded model.
+    #Samples are drawn genChunkSize at a time, and each chunk is handed to a process pool to be converted and
+    #written out while the next one is sampling. Only a couple of chunks per worker are ever in flight.
+    @Profiled()
+    def GenerateBulk(self, model, numSamples, sampleSaveLoc):
+
+        startTime = time.perf_counter()
+        pending = collections.deque()
+        written = 0
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.genWorkers, mp_context=POOL_CONTEXT) as pool:
+
+            for first in tqdm(range(0, numSamples, self.genChunkSize)):
+                if self.IsCancelled():
+                    break
+
+                count = min(self.genChunkSize, numSamples - first)
+
+                #Samples are binary, so ship them to the workers as bytes rather than floats.
+                with Span("RBMNet.Generate.sample"):
+                    chunk = num.reshape(model.Sample(count).astype(num.uint8),
+                                        (count, model.timesteps, 2 * self.notespan))
+                pending.append(pool.submit(WriteSampleChunk, self.midi, chunk, sampleSaveLoc, first))
+
+                #Don't let sampling run too far ahead of the writers.
+                while len(pending) > 2 * self.genWorkers:
+                    written += pending.popleft().result()
+
+                self.ReportProgress("Generating", first + count, numSamples)
+
+            while pending:
+                written += pending.popleft().result()
+
+        if self.IsCancelled():
+            print("Generation cancelled after {} samples.".format(written))
+            return False
+
+        genTime = time.perf_counter() - startTime
+        print("Generated {} samples ({} written) in {:.2f}s ({:.1f} samples/sec)".format(
+            numSamples, written, genTime, numSamples / max(genTime, 1e-9)))
+        print("Saved samples to " + sampleSaveLoc)
+        return True
+
+    #Fetch a model for generation, loading it only if it isn't already resident.
+    #Entries are keyed on the directory and its files' modification times, so retraining into the same
+    #directory is picked up. Least recently used models are dropped once we hold more than modelCacheSize.
+    def GetResidentModel(self, modelLoadLoc, useNumpy):
+
+        modelDir = os.path.realpath(modelLoadLoc)
+        precision = self.genPrecision if useNumpy else "float32"
+        key = (modelDir, ModelStamp(modelDir), useNumpy, precision)
+
+        if key in self.modelCache:
+            self.modelCache.move_to_end(key)
+            return self.modelCache[key]
+
         print("Loading model from " + modelLoadLoc + "...")
-        tf.reset_default_graph()
 
-        with tf.Session() as session:
+        if useNumpy:
+            model = NumpyRBM.Load(modelLoadLoc, self.notespan)
 
-            session.run(tf.global_variables_initializer())
+            if precision != "float32":
+                model = self.ReduceModel(model, precision)
+        else:
+            model = self.LoadResidentModel(modelLoadLoc)
+
+        #Anything else cached for this directory is out of date now.
+        for staleKey in [k for k in self.modelCache if k[0] == modelDir]:
+            self.CloseResidentModel(self.modelCache.pop(staleKey))
+
+        self.modelCache[key] = model
+
+        while len(self.modelCache) > self.modelCacheSize:
+            self.CloseResidentModel(self.modelCache.popitem(last=False)[1])
+
+        return model
+
+    #Drop a loaded model's weights to the given precision, reporting how much its note probabilities change.
+    def ReduceModel(self, model, precision):
+        reducedModel = ReducedRBM(model, precision)
+        divergence = reducedModel.Divergence(model)
+
+        print("Sampling at {} ({:.0f}KB of weights, down from {:.0f}KB).".format(
+            precision, reducedModel.WeightBytes() / 1024, model.wMatrix.nbytes / 1024))
+        print("Divergence from float32 - note probabilities: max {notes_max:.2e}, mean {notes_mean:.2e}; "
+              "hidden probabilities: max {hidden_max:.2e}, mean {hidden_mean:.2e}".format(**divergence))
+
+        return reducedModel
+
+    #Restore a SavedModel into its own graph and session, with the sampling op built once up front.
+    @Profiled()
+    def LoadResidentModel(self, modelLoadLoc):
+
+        ImportTensorflow()
+        graph = tf.Graph()
+
+        with graph.as_default():
+            session = tf.Session(graph=graph)
+            self.LoadSavedModel(session, modelLoadLoc)
+
+            notedata = tf.placeholder(tf.float32, [None, self.vNodes])
+            sampleOp = Gibbs(k=1, x=notedata, wMatrix=self.wMatrix, hBias=self.hBias, vBias=self.vBias)
+
+        #Nothing else should be added to a resident graph.
+        graph.finalize()
+
+        return ResidentModel(session, notedata, sampleOp, self.timesteps, self.vNodes)
+
+    def CloseResidentModel(self, model):
+        if isinstance(model, ResidentModel):
+            model.Close()
+
+    #Drop every resident model (and close their sessions).
+    def ClearModelCache(self):
+        while self.modelCache:
+            self.CloseResidentModel(self.modelCache.popitem()[1])
+
+    #Reshape and convert our data back into MIDI format for each sample generated.
+    @Profiled()
+    def WriteSamples(self, sample, sampleSaveLoc):
 
-            #Restore our graph state.
-            tf.saved_model.loader.load(session, ["RBMNet"], modelLoadLoc)
-
-            #To my knowledge, this really is the best way to reinitialize our Tensorflow variable references. Sad!
-            for v in tf.global_variables():
-                if "wMatrix" in v.name:
-                    self.wMatrix = v
-                elif "vBias" in v.name:
-                    self.vBias = v
-                elif "hBias" in v.name:
-                    self.hBias = v
-                elif "timesteps" in v.name:
-                    self.tfTimesteps = v
-
-            self.timesteps = session.run(self.tfTimesteps)
-            self.vNodes = 2 * self.notespan * self.timesteps
-
-            self.notedata = tf.placeholder(tf.float32, [None, self.vNodes])
-
-            #Sample our network.
-            #This will generate a multidimensional array containing reconstructed visible layer data (i.e., songs)
-            #for every sample we want to generate (the number of samples is customizable in the UI).
-            sample = Gibbs(k=1, x=self.notedata, wMatrix=self.wMatrix, hBias=self.hBias, vBias=self.vBias).eval(
-                session=session, feed_dict={self.notedata: num.zeros((self.genSample, self.vNodes))})
-
-            #Reshape and convert our data back into MIDI format for each sample generated.
-            for i in range(sample.shape[0]):
-                if not any(sample[i, :]):
-                    continue
-                S = num.reshape(sample[i, :], (self.timesteps, 2 * self.notespan))
-                self.midi.FVtoMIDI(S, sampleSaveLoc + "/OutputSample-{}".format(i))
+        for i in range(sample.shape[0]):
+            if not any(sample[i, :]):
+                continue
+            S = num.reshape(sample[i, :], (self.timesteps, 2 * self.notespan))
+            self.midi.FVtoMIDI(S, sampleSaveLoc + "/OutputSample-{}".format(i))
 
         print("Saved samples to " + sampleSaveLoc)
-        return True
\ No newline at end of file
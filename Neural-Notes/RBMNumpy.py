@@ -0,0 +1,284 @@
+'''
+RBMNUMPY.PY
+
+This script is a pure-NumPy version of the RBM in RBMNet.
+Same parameters, same CD-k training and Gibbs sampling - just no Tensorflow import, graph or session to pay for.
+Handy for CPU training/generation on our (fairly small) models.
+
+DEPENDENCIES:
+
+Numpy - math library (matmuls go through whatever BLAS it's built against).
+OS - directory path utilities.
+JSON/Struct - weights file header.
+Profiler - optional timing spans.
+'''
+
+import json
+import numpy as num
+import os
+import struct
+
+from Profiler import Profiled
+
+#File the NumPy engine stores its weights in, inside a model directory.
+WEIGHTS_FILE = 'weights.nnw'
+
+#Precisions ReducedRBM can hold its weight matrix at.
+PRECISIONS = ("float32", "float16", "int8")
+
+#Rows of the weight matrix widened back to float32 at a time by ReducedRBM.
+#Small enough that a block stays in cache between being converted and being multiplied.
+REDUCED_BLOCK = 512
+
+#Weights file layout: magic, header length (little-endian uint32), JSON header, then the raw arrays.
+#Arrays are little-endian float32 in C order, each starting on a 64 byte boundary, so they can be memory-mapped as-is.
+WEIGHTS_MAGIC = b'NNRBMW01'
+WEIGHTS_DTYPE = num.dtype('<f4')
+WEIGHTS_ALIGN = 64
+WEIGHTS_ARRAYS = ("wMatrix", "vBias", "hBias")
+
+def AlignUp(offset):
+    return -(-offset // WEIGHTS_ALIGN) * WEIGHTS_ALIGN
+
+#Write weight arrays and metadata out in the weights file format.
+#Written to a temporary file first and swapped in, so processes with the old file mapped keep their copy intact.
+def WriteWeightsFile(filename, arrays, metadata):
+    header = dict(metadata, dtype=WEIGHTS_DTYPE.str, arrays={})
+
+    #Offsets depend on the header's length, which depends on the offsets - two passes settle it,
+    #since rounding up to the alignment absorbs the difference in digits.
+    offset = 0
+    for attempt in range(2):
+        offset = AlignUp(len(WEIGHTS_MAGIC) + 4 + len(json.dumps(header).encode()))
+
+        for name in WEIGHTS_ARRAYS:
+            header["arrays"][name] = {"offset": offset, "shape": list(arrays[name].shape)}
+            offset = AlignUp(offset + arrays[name].size * WEIGHTS_DTYPE.itemsize)
+
+    headerBytes = json.dumps(header).encode()
+    tmpName = "{}.{}.tmp".format(filename, os.getpid())
+
+    with open(tmpName, 'wb') as weightsFile:
+        weightsFile.write(WEIGHTS_MAGIC + struct.pack('<I', len(headerBytes)) + headerBytes)
+
+        for name in WEIGHTS_ARRAYS:
+            weightsFile.write(b'\0' * (header["arrays"][name]["offset"] - weightsFile.tell()))
+            weightsFile.write(num.ascontiguousarray(arrays[name], WEIGHTS_DTYPE).tobytes())
+
+    os.replace(tmpName, filename)
+
+#Read a weights file, returning (metadata, {name: array}).
+#Arrays are read-only memory maps of the file unless copy is set - no reading happens until they're used,
+#and every process mapping the same file shares its pages.
+def ReadWeightsFile(filename, copy=False):
+    with open(filename, 'rb') as weightsFile:
+        if weightsFile.read(len(WEIGHTS_MAGIC)) != WEIGHTS_MAGIC:
+            raise ValueError(filename + " is not a weights file")
+
+        headerLen, = struct.unpack('<I', weightsFile.read(4))
+        header = json.loads(weightsFile.read(headerLen).decode())
+
+    arrays = {}
+
+    for name in WEIGHTS_ARRAYS:
+        entry = header["arrays"][name]
+        arrays[name] = num.memmap(filename, num.dtype(header["dtype"]), 'r', entry["offset"], tuple(entry["shape"]))
+
+        if copy:
+            arrays[name] = num.array(arrays[name])
+
+    return header, arrays
+
+#Logistic function, written in terms of tanh so large activations don't overflow.
+def Sigmoid(x):
+    return 0.5 * (1.0 + num.tanh(0.5 * x))
+
+#Probabilistic random sampling - same as RBMNet.ProbSample.
+#floor(p + U(0,1)) is 1 exactly when U >= 1 - p, i.e. with probability p.
+def ProbSample(p, rng):
+    return (rng.random(p.shape, dtype=num.float32) < p).astype(num.float32)
+
+#"Gibbs Sampling" - k rounds of propagating the visible layer forward and reconstructing it.
+def Gibbs(k, x, wMatrix, hBias, vBias, rng):
+    xk = x
+
+    for i in range(k):
+        hk = ProbSample(Sigmoid(xk @ wMatrix + hBias), rng)
+        xk = ProbSample(Sigmoid(hk @ wMatrix.T + vBias), rng)
+
+    return xk
+
+'''
+NumpyRBM class.
+Holds the weight matrix/biases and runs training and sampling on them.
+'''
+class NumpyRBM:
+
+    def __init__(self, notespan, timesteps, hNodes, seed=None, randomInit=True):
+        self.rng = num.random.default_rng(seed)
+        self.notespan = notespan
+        self.timesteps = timesteps
+        self.vNodes = 2 * notespan * timesteps
+        self.hNodes = hNodes
+
+        #Same starting point as RBMNet - note that random_normal's second argument there is the mean,
+        #so the weights are drawn from N(0.01, 1). Biases start as zeroes.
+        #Skipped when we're about to drop in existing weights anyway.
+        if randomInit:
+            self.wMatrix = self.rng.normal(0.01, 1.0, (self.vNodes, self.hNodes)).astype(num.float32)
+            self.vBias = num.zeros((1, self.vNodes), num.float32)
+            self.hBias = num.zeros((1, self.hNodes), num.float32)
+
+    #One CD-k update from a batch of visible layer data.
+    #Mirrors RBMNet.BuildTrainUpdate.
+    def TrainBatch(self, notedata, learnRate, k=1):
+        noteSample = Gibbs(k, notedata, self.wMatrix, self.hBias, self.vBias, self.rng)
+
+        hdata = ProbSample(Sigmoid(notedata @ self.wMatrix + self.hBias), self.rng)
+        hSample = ProbSample(Sigmoid(noteSample @ self.wMatrix + self.hBias), self.rng)
+
+        scale = num.float32(learnRate / notedata.shape[0])
+
+        self.wMatrix += scale * (notedata.T @ hdata - noteSample.T @ hSample)
+        self.vBias += scale * num.sum(notedata - noteSample, 0, keepdims=True)
+        self.hBias += scale * num.sum(hdata - hSample, 0, keepdims=True)
+
+    #One pass over an epoch's worth of minibatches (see Corpus.Batches).
+    @Profiled()
+    def TrainEpoch(self, batches, learnRate, k=1):
+        for notedata in batches:
+            self.TrainBatch(notedata, learnRate, k)
+
+    #Probabilities of each hidden node being on, given visible layer data.
+    def HiddenProbs(self, x):
+        return Sigmoid(x @ self.wMatrix + self.hBias)
+
+    #Probabilities of each note being on, given hidden layer states.
+    def VisibleProbs(self, h):
+        return Sigmoid(h @ self.wMatrix.T + self.vBias)
+
+    #Sample new songs, starting from silence like RBMNet.Generate.
+    #Returns one row of visible layer data per sample.
+    @Profiled()
+    def Sample(self, numSamples, k=1):
+        return Gibbs(k, num.zeros((numSamples, self.vNodes), num.float32),
+                     self.wMatrix, self.hBias, self.vBias, self.rng)
+
+    #Weights are stored under the same names as the Tensorflow variables.
+    def Save(self, modelDir):
+        os.makedirs(modelDir, exist_ok=True)
+        WriteWeightsFile(os.path.join(modelDir, WEIGHTS_FILE),
+                         {"wMatrix": self.wMatrix, "vBias": self.vBias, "hBias": self.hBias},
+                         {"timesteps": int(self.timesteps), "notespan": int(self.notespan),
+                          "vNodes": int(self.vNodes), "hNodes": int(self.hNodes)})
+
+    @staticmethod
+    def IsStored(modelDir):
+        return os.path.isfile(os.path.join(modelDir, WEIGHTS_FILE))
+
+    #Weights are memory-mapped read-only, which is all sampling needs.
+    #Anything that's going to keep training them needs its own copy.
+    @staticmethod
+    def Load(modelDir, notespan, seed=None, copy=False):
+        header, weights = ReadWeightsFile(os.path.join(modelDir, WEIGHTS_FILE), copy)
+
+        if header["notespan"] != notespan:
+            raise ValueError("Model covers {} notes, expected {}".format(header["notespan"], notespan))
+
+        return NumpyRBM.FromWeights(notespan, weights['wMatrix'], weights['vBias'], weights['hBias'],
+                                    header["timesteps"], seed, copy=False)
+
+    #Wrap existing weights (e.g. pulled out of a Tensorflow session).
+    #They're copied unless told otherwise, in which case float32 arrays are used as they are.
+    @staticmethod
+    def FromWeights(notespan, wMatrix, vBias, hBias, timesteps, seed=None, copy=True):
+        rbm = NumpyRBM(notespan, timesteps, wMatrix.shape[1], seed, randomInit=False)
+
+        if wMatrix.shape[0] != rbm.vNodes:
+            raise ValueError("Weight matrix has {} visible nodes, expected {} for {} timesteps".format(
+                wMatrix.shape[0], rbm.vNodes, timesteps))
+
+        rbm.wMatrix = num.array(wMatrix, num.float32, copy=copy or None)
+        rbm.vBias = num.array(vBias, num.float32, copy=copy or None).reshape(1, rbm.vNodes)
+        rbm.hBias = num.array(hBias, num.float32, copy=copy or None).reshape(1, rbm.hNodes)
+
+        return rbm
+
+'''
+ReducedRBM class.
+Sampling-only copy of a NumpyRBM with its weight matrix held at reduced precision - float16, or int8 with
+one scale per hidden node (column). Biases stay float32, as they're tiny.
+NumPy has no fast half-precision or integer matmul, so the matrix is widened back to float32 a block of rows
+at a time just before it's used. The full-size float32 matrix never exists, so the model takes a half or a quarter
+of the memory, and far less of it has to be streamed through the cache for every sample.
+Has the same Sample interface as NumpyRBM.
+'''
+class ReducedRBM:
+
+    def __init__(self, rbm, precision):
+        self.rng = rbm.rng
+        self.notespan = rbm.notespan
+        self.timesteps = rbm.timesteps
+        self.vNodes = rbm.vNodes
+        self.hNodes = rbm.hNodes
+        self.precision = precision
+        self.vBias = num.array(rbm.vBias, num.float32)
+        self.hBias = num.array(rbm.hBias, num.float32)
+
+        wMatrix = num.asarray(rbm.wMatrix, num.float32)
+
+        if precision == "float16":
+            self.wMatrix = wMatrix.astype(num.float16)
+            self.scale = num.ones((1, self.hNodes), num.float32)
+
+        #Each column is scaled so its largest weight maps to +/-127.
+        elif precision == "int8":
+            peak = num.abs(wMatrix).max(axis=0, keepdims=True)
+            self.scale = num.where(peak > 0, peak / 127.0, 1.0).astype(num.float32)
+            self.wMatrix = num.round(wMatrix / self.scale).astype(num.int8)
+
+        else:
+            raise ValueError("Unsupported precision {} (expected float16 or int8)".format(precision))
+
+    #Column scales apply to the hidden side, so they can be applied after the matmul...
+    def HiddenProbs(self, x):
+        activation = num.zeros((x.shape[0], self.hNodes), num.float32)
+
+        for i in range(0, self.vNodes, REDUCED_BLOCK):
+            activation += x[:, i:i + REDUCED_BLOCK] @ self.wMatrix[i:i + REDUCED_BLOCK].astype(num.float32)
+
+        return Sigmoid(activation * self.scale + self.hBias)
+
+    #...or folded into the hidden states before it.
+    def VisibleProbs(self, h):
+        scaledH = h * self.scale
+        activation = num.empty((h.shape[0], self.vNodes), num.float32)
+
+        for i in range(0, self.vNodes, REDUCED_BLOCK):
+            activation[:, i:i + REDUCED_BLOCK] = scaledH @ self.wMatrix[i:i + REDUCED_BLOCK].astype(num.float32).T
+
+        return Sigmoid(activation + self.vBias)
+
+    def Sample(self, numSamples, k=1):
+        xk = num.zeros((numSamples, self.vNodes), num.float32)
+
+        for i in range(k):
+            hk = ProbSample(self.HiddenProbs(xk), self.rng)
+            xk = ProbSample(self.VisibleProbs(hk), self.rng)
+
+        return xk
+
+    #How far this model's probabilities stray from the full-precision original, over realistic inputs:
+    #samples from the original, and the hidden states they produce.
+    def Divergence(self, reference, numSamples=256):
+        x = reference.Sample(numSamples)
+        h = ProbSample(reference.HiddenProbs(x), self.rng)
+
+        hiddenDiff = num.abs(self.HiddenProbs(x) - reference.HiddenProbs(x))
+        visibleDiff = num.abs(self.VisibleProbs(h) - reference.VisibleProbs(h))
+
+        return {"hidden_max": float(hiddenDiff.max()), "hidden_mean": float(hiddenDiff.mean()),
+                "notes_max": float(visibleDiff.max()), "notes_mean": float(visibleDiff.mean())}
+
+    def WeightBytes(self):
+        return self.wMatrix.nbytes + self.scale.nbytes
@@ -0,0 +1,274 @@
+'''
+TEST_FORMATS.PY
+
+Round-trip checks for the training set and weights formats - the bit-packed corpus (in memory and as a file),
+training windows, transposition, and the NumPy engine's weights file.
+All pure NumPy, so no Tensorflow or MIDI library is needed.
+
+Run from the Neural-Notes folder with either:
+python -m pytest tests
+python -m unittest discover tests
+
+DEPENDENCIES:
+
+Unittest - test runner.
+Tempfile - scratch files.
+Numpy - math library.
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as num
+
+#The scripts aren't a package, so make them importable from here.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from Corpus import Corpus, CorpusWriter, Transpose, CORPUS_EXT
+from RBMNumpy import NumpyRBM, WriteWeightsFile, ReadWeightsFile, WEIGHTS_ALIGN, WEIGHTS_FILE
+
+#Deliberately not a multiple of 8, so the last packed byte of every frame is only partly used.
+NOTESPAN = 13
+WIDTH = 2 * NOTESPAN
+
+def RandomSongs(lengths, seed=0):
+    rng = num.random.default_rng(seed)
+    return [(rng.random((length, WIDTH)) < 0.3).astype(num.uint8) for length in lengths]
+
+'''
+CorpusTest class.
+Packing, windowing and transposing an in-memory corpus.
+'''
+class CorpusTest(unittest.TestCase):
+
+    def testPackUnpackOddWidth(self):
+        songs = RandomSongs([5, 0, 9, 1])
+        corpus = Corpus.FromSongs(songs, WIDTH)
+
+        self.assertEqual(corpus.packedWidth, 4)
+        self.assertEqual(corpus.frames.shape, (15, 4))
+        self.assertEqual(len(corpus), len(songs))
+        self.assertEqual(corpus.NumFrames(), 15)
+        num.testing.assert_array_equal(corpus.SongLengths(), [5, 0, 9, 1])
+
+        for song, unpacked in zip(songs, corpus):
+            self.assertEqual(unpacked.shape, song.shape)
+            num.testing.assert_array_equal(unpacked, song)
+
+    def testEmptyCorpus(self):
+        corpus = Corpus.FromSongs([], WIDTH)
+
+        self.assertEqual(len(corpus), 0)
+        self.assertEqual(len(corpus.WindowStarts(4)), 0)
+
+    def testWindowStartsOverlapping(self):
+        corpus = Corpus.FromSongs(RandomSongs([10, 3, 20]), WIDTH)
+
+        #Song 1 is shorter than a window, so only songs 0 (frames 0-9) and 2 (frames 13-32) have any.
+        num.testing.assert_array_equal(corpus.WindowStarts(4, hop=2), [0, 2, 4, 6] + list(range(13, 30, 2)))
+
+        #Hop of 0 (or none) means back-to-back windows.
+        num.testing.assert_array_equal(corpus.WindowStarts(4, hop=0), [0, 4, 13, 17, 21, 25, 29])
+        num.testing.assert_array_equal(corpus.WindowStarts(4), corpus.WindowStarts(4, hop=4))
+
+    def testWindowStartsMinLength(self):
+        corpus = Corpus.FromSongs(RandomSongs([10, 3, 20]), WIDTH)
+
+        #Training asks for songs more than two windows long - song 0 just makes it at 10 frames, then drops out.
+        num.testing.assert_array_equal(corpus.WindowStarts(4, 2 * 4 + 1, hop=3), [0, 3, 6, 13, 16, 19, 22, 25, 28])
+        num.testing.assert_array_equal(corpus.WindowStarts(4, 11, hop=3), [13, 16, 19, 22, 25, 28])
+        self.assertEqual(len(corpus.WindowStarts(4, 21)), 0)
+
+    def testWindowStartsNegativeHop(self):
+        corpus = Corpus.FromSongs(RandomSongs([10]), WIDTH)
+
+        with self.assertRaises(ValueError):
+            corpus.WindowStarts(4, hop=-1)
+
+    def testWindowsMatchSongs(self):
+        songs = RandomSongs([10, 3, 20])
+        corpus = Corpus.FromSongs(songs, WIDTH)
+        starts = corpus.WindowStarts(4, hop=3)
+        rows = corpus.Windows(starts, 4)
+
+        self.assertEqual(rows.shape, (len(starts), 4 * WIDTH))
+        self.assertEqual(rows.dtype, num.float32)
+
+        allFrames = num.concatenate(songs)
+
+        for start, row in zip(starts, rows):
+            num.testing.assert_array_equal(row, allFrames[start:start + 4].ravel())
+
+    def testBatchesCoverEveryWindow(self):
+        corpus = Corpus.FromSongs(RandomSongs([10, 3, 20]), WIDTH)
+        starts = corpus.WindowStarts(4, hop=2)
+        batches = list(corpus.Batches(starts, 4, 5, num.random.default_rng(1)))
+
+        self.assertEqual([len(batch) for batch in batches], [5, 5, 3])
+
+        #Same windows, just shuffled.
+        expected = sorted(map(bytes, corpus.Windows(starts, 4, num.uint8)))
+        self.assertEqual(sorted(map(bytes, num.concatenate(batches).astype(num.uint8))), expected)
+
+    def testTransposeClipsBothEnds(self):
+        #One window, one frame: lowest and highest notes held, lowest and a middle note articulated.
+        frame = num.zeros(WIDTH, num.uint8)
+        frame[[0, NOTESPAN - 1]] = 1
+        frame[[NOTESPAN, NOTESPAN + 5]] = 1
+        rows = num.tile(frame, (4, 1, 1))
+
+        shifted = Transpose(rows, num.array([0, 1, -1, NOTESPAN]))
+        held, articulated = shifted[:, 0, :NOTESPAN], shifted[:, 0, NOTESPAN:]
+
+        num.testing.assert_array_equal(shifted[0], rows[0])
+
+        #Up a semitone - the top note falls off rather than spilling into the articulated half.
+        num.testing.assert_array_equal(num.flatnonzero(held[1]), [1])
+        num.testing.assert_array_equal(num.flatnonzero(articulated[1]), [1, 6])
+
+        #Down a semitone - the bottom note falls off.
+        num.testing.assert_array_equal(num.flatnonzero(held[2]), [NOTESPAN - 2])
+        num.testing.assert_array_equal(num.flatnonzero(articulated[2]), [4])
+
+        #Shifted by the whole range, nothing is left.
+        self.assertEqual(shifted[3].sum(), 0)
+
+    def testWindowsTransposed(self):
+        corpus = Corpus.FromSongs(RandomSongs([12]), WIDTH)
+        starts = corpus.WindowStarts(4)
+        shifts = num.array([2, -3, 0])
+
+        plain = corpus.Windows(starts, 4, num.uint8).reshape(-1, 4, WIDTH)
+        num.testing.assert_array_equal(corpus.Windows(starts, 4, num.uint8, shifts),
+                                       Transpose(plain, shifts).reshape(len(starts), -1))
+
+'''
+CorpusFileTest class.
+Corpus files written with CorpusWriter and mapped back in.
+'''
+class CorpusFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.scratch.name, "songs" + CORPUS_EXT)
+
+    def tearDown(self):
+        self.scratch.cleanup()
+
+    def testRoundTrip(self):
+        songs = RandomSongs([7, 0, 30, 2], seed=3)
+        writer = CorpusWriter(self.filename, WIDTH)
+
+        for song in songs:
+            writer.Append(song)
+
+        written = writer.Close()
+        reopened = Corpus.Open(self.filename)
+        inMemory = Corpus.FromSongs(songs, WIDTH)
+
+        for corpus in (written, reopened):
+            self.assertTrue(corpus.IsMapped())
+            self.assertEqual(corpus.width, WIDTH)
+            self.assertEqual(len(corpus), len(songs))
+            num.testing.assert_array_equal(corpus.offsets, inMemory.offsets)
+            num.testing.assert_array_equal(corpus.frames, inMemory.frames)
+
+            for song, unpacked in zip(songs, corpus):
+                num.testing.assert_array_equal(unpacked, song)
+
+            num.testing.assert_array_equal(corpus.Windows(corpus.WindowStarts(4, hop=1), 4),
+                                           inMemory.Windows(inMemory.WindowStarts(4, hop=1), 4))
+
+        #Only the finished file is left behind.
+        self.assertEqual(os.listdir(self.scratch.name), [os.path.basename(self.filename)])
+
+    def testEmptyFile(self):
+        corpus = CorpusWriter(self.filename, WIDTH).Close()
+
+        self.assertEqual(len(corpus), 0)
+        self.assertEqual(corpus.frames.shape, (0, 4))
+        self.assertEqual(len(Corpus.Open(self.filename)), 0)
+
+    def testAbort(self):
+        writer = CorpusWriter(self.filename, WIDTH)
+        writer.Append(RandomSongs([5])[0])
+        writer.Abort()
+
+        self.assertEqual(os.listdir(self.scratch.name), [])
+
+    def testNotACorpus(self):
+        with open(self.filename, 'wb') as badFile:
+            badFile.write(b'not a corpus file at all')
+
+        with self.assertRaises(ValueError):
+            Corpus.Open(self.filename)
+
+'''
+WeightsFileTest class.
+The NumPy engine's weights file, written out and mapped back in.
+'''
+class WeightsFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.TemporaryDirectory()
+        self.rng = num.random.default_rng(5)
+
+    def tearDown(self):
+        self.scratch.cleanup()
+
+    def testRoundTrip(self):
+        filename = os.path.join(self.scratch.name, WEIGHTS_FILE)
+        arrays = {"wMatrix": self.rng.normal(size=(WIDTH * 3, 7)).astype(num.float32),
+                  "vBias": self.rng.normal(size=(1, WIDTH * 3)).astype(num.float32),
+                  "hBias": self.rng.normal(size=(1, 7)).astype(num.float32)}
+
+        WriteWeightsFile(filename, arrays, {"timesteps": 3, "notespan": NOTESPAN})
+        header, mapped = ReadWeightsFile(filename)
+
+        self.assertEqual(header["timesteps"], 3)
+        self.assertEqual(header["notespan"], NOTESPAN)
+
+        for name, array in arrays.items():
+            self.assertEqual(header["arrays"][name]["offset"] % WEIGHTS_ALIGN, 0)
+            self.assertIsInstance(mapped[name], num.memmap)
+            self.assertFalse(mapped[name].flags.writeable)
+            num.testing.assert_array_equal(mapped[name], array)
+
+        header, copied = ReadWeightsFile(filename, copy=True)
+
+        for name, array in arrays.items():
+            self.assertNotIsInstance(copied[name], num.memmap)
+            num.testing.assert_array_equal(copied[name], array)
+
+    def testModelRoundTrip(self):
+        timesteps, hNodes = 4, 9
+        vNodes = 2 * NOTESPAN * timesteps
+        model = NumpyRBM.FromWeights(NOTESPAN, self.rng.normal(size=(vNodes, hNodes)),
+                                     self.rng.normal(size=(1, vNodes)), self.rng.normal(size=(1, hNodes)), timesteps)
+        model.Save(self.scratch.name)
+
+        self.assertTrue(NumpyRBM.IsStored(self.scratch.name))
+
+        loaded = NumpyRBM.Load(self.scratch.name, NOTESPAN)
+
+        self.assertEqual((loaded.timesteps, loaded.vNodes, loaded.hNodes), (timesteps, vNodes, hNodes))
+        num.testing.assert_array_equal(loaded.wMatrix, model.wMatrix)
+        num.testing.assert_array_equal(loaded.vBias, model.vBias)
+        num.testing.assert_array_equal(loaded.hBias, model.hBias)
+
+        with self.assertRaises(ValueError):
+            NumpyRBM.Load(self.scratch.name, NOTESPAN + 1)
+
+    def testNotAWeightsFile(self):
+        filename = os.path.join(self.scratch.name, WEIGHTS_FILE)
+
+        with open(filename, 'wb') as badFile:
+            badFile.write(b'not a weights file either')
+
+        with self.assertRaises(ValueError):
+            ReadWeightsFile(filename)
+
+if __name__ == '__main__':
+    unittest.main()
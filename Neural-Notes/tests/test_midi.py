@@ -0,0 +1,382 @@
+'''
+TEST_MIDI.PY
+
+Checks that MIDItoFV and FVtoMIDI give exactly the piano rolls/events the original tick-by-tick versions did.
+Python-MIDI is swapped out for a small stand-in (just the event classes, Pattern and file IO), so patterns are
+built in memory and nothing touches the disk.
+
+Run from the Neural-Notes folder with either:
+python -m pytest tests
+python -m unittest discover tests
+
+DEPENDENCIES:
+
+Unittest - test runner.
+Types - the stand-in midi module.
+Numpy - math library.
+'''
+
+import os
+import sys
+import types
+import unittest
+
+import numpy as num
+
+#The scripts aren't a package, so make them importable from here.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+'''
+Stand-in for the parts of Python-MIDI that MidiWrapper uses.
+read_midifile hands back whatever pattern was stored under that name, and write_midifile stores it.
+'''
+class Event:
+
+    def __init__(self, tick=0, **fields):
+        self.tick = tick
+        self.__dict__.update(fields)
+
+class NoteEvent(Event):
+    pass
+
+class NoteOnEvent(NoteEvent):
+    pass
+
+class NoteOffEvent(NoteEvent):
+    pass
+
+class TimeSignatureEvent(Event):
+    pass
+
+class EndOfTrackEvent(Event):
+    pass
+
+class Track(list):
+    pass
+
+class Pattern(list):
+
+    def __init__(self, tracks=(), resolution=220):
+        super().__init__(tracks)
+        self.resolution = resolution
+
+fakeMidi = types.ModuleType("midi")
+fakeMidi.NoteEvent = NoteEvent
+fakeMidi.NoteOnEvent = NoteOnEvent
+fakeMidi.NoteOffEvent = NoteOffEvent
+fakeMidi.TimeSignatureEvent = TimeSignatureEvent
+fakeMidi.EndOfTrackEvent = EndOfTrackEvent
+fakeMidi.Track = Track
+fakeMidi.Pattern = Pattern
+fakeMidi.files = {}
+fakeMidi.read_midifile = lambda filename: fakeMidi.files[filename]
+fakeMidi.write_midifile = lambda filename, pattern: fakeMidi.files.__setitem__(filename, pattern)
+
+#MidiWrapper binds whichever midi module it sees on import - make sure that's ours, then put things back.
+realMidi = sys.modules.get("midi")
+sys.modules["midi"] = fakeMidi
+sys.modules.pop("MidiWrapper", None)
+
+import MidiWrapper as nn_midi
+
+if realMidi is not None:
+    sys.modules["midi"] = realMidi
+else:
+    del sys.modules["midi"]
+
+#The original MIDItoFV - steps through every tick of the file, checking each track for events as it goes.
+#Kept as the reference the event-merging parser has to match.
+def ReferenceMIDItoFV(midiUtil, midiEvents):
+    trackTimes = [track[0].tick for track in midiEvents]
+    trackPos = [0 for track in midiEvents]
+
+    fv = []
+    curState = [[0, 0] for n in range(midiUtil.notespan)]
+    fv.append(curState)
+
+    keepParsing = True
+    tick = 0
+
+    while keepParsing:
+
+        if tick % (midiEvents.resolution / 4) == (midiEvents.resolution / 8):
+            prevState = curState
+            curState = [[prevState[n][0], 0] for n in range(midiUtil.notespan)]
+            fv.append(curState)
+
+        for t in range(len(trackTimes)):
+
+            if not keepParsing:
+                break
+
+            while trackTimes[t] == 0:
+                track = midiEvents[t]
+                tPos = trackPos[t]
+                tEvent = track[tPos]
+
+                if isinstance(tEvent, NoteEvent):
+                    if (tEvent.pitch < midiUtil.lowBound) or (tEvent.pitch >= midiUtil.highBound):
+                        pass
+                    elif isinstance(tEvent, NoteOnEvent) and tEvent.velocity != 0:
+                        curState[tEvent.pitch - midiUtil.lowBound] = [1, 1]
+                    else:
+                        curState[tEvent.pitch - midiUtil.lowBound] = [0, 0]
+                elif isinstance(tEvent, TimeSignatureEvent):
+                    if tEvent.numerator not in (2, 4):
+                        keepParsing = False
+                        break
+
+                if tPos + 1 < len(track):
+                    trackTimes[t] = track[tPos + 1].tick
+                    trackPos[t] += 1
+                else:
+                    trackTimes[t] = None
+
+            if trackTimes[t] is not None:
+                trackTimes[t] -= 1
+
+        if all(tTime is None for tTime in trackTimes) or len(fv) > midiUtil.maxLength:
+            break
+
+        tick += 1
+
+    fvArray = num.array(fv)
+    return num.hstack((fvArray[:, :, 0], fvArray[:, :, 1])).tolist()
+
+#The original FVtoMIDI's event loop, as (type, tick, pitch) - one frame at a time, releases then presses.
+#Closes with a silent frame, so anything still held at the end is released.
+def ReferenceFVtoMIDI(midiUtil, fv):
+    fv = num.asarray(fv)
+    frames = list(num.dstack((fv[:, :midiUtil.notespan], fv[:, midiUtil.notespan:])))
+    frames.append(num.zeros((midiUtil.notespan, 2), int))
+
+    events = []
+    lTime = 0
+    prevState = num.zeros((midiUtil.notespan, 2), int)
+
+    for fTime, fState in enumerate(frames):
+        notesOn = []
+        notesOff = []
+
+        for n in range(midiUtil.notespan):
+            if prevState[n][0] == 1:
+                if fState[n][0] == 0:
+                    notesOff.append(n)
+                elif fState[n][1] == 1:
+                    notesOn.append(n)
+            elif fState[n][0] == 1:
+                notesOn.append(n)
+
+        for note in notesOff:
+            events.append(("off", (fTime - lTime) * midiUtil.tickScale, note + midiUtil.lowBound))
+            lTime = fTime
+
+        for note in notesOn:
+            events.append(("on", (fTime - lTime) * midiUtil.tickScale, note + midiUtil.lowBound))
+            lTime = fTime
+
+        prevState = fState
+
+    return events
+
+#A multi-track pattern of random notes - some out of range, some released by zero-velocity presses,
+#with events piling up on the same ticks (within and across tracks).
+def RandomPattern(rng, resolution, numTracks=3, numEvents=60, timeSignature=None):
+    pattern = Pattern(resolution=resolution)
+
+    for t in range(numTracks):
+        track = Track()
+
+        if t == 0:
+            track.append(TimeSignatureEvent(tick=0, numerator=4, denominator=4))
+
+        for i in range(numEvents):
+            tick = int(rng.choice([0, 0, 1, resolution // 8, resolution // 4, resolution]))
+            pitch = int(rng.integers(30, 90))
+            kind = rng.integers(3)
+
+            if kind == 0:
+                track.append(NoteOnEvent(tick=tick, pitch=pitch, velocity=80))
+            elif kind == 1:
+                track.append(NoteOnEvent(tick=tick, pitch=pitch, velocity=0))
+            else:
+                track.append(NoteOffEvent(tick=tick, pitch=pitch))
+
+            if timeSignature is not None and t == 1 and i == numEvents // 2:
+                track.append(TimeSignatureEvent(tick=0, numerator=timeSignature, denominator=4))
+
+        track.append(EndOfTrackEvent(tick=1))
+        pattern.append(track)
+
+    return pattern
+
+'''
+MIDItoFVTest class.
+Parsing patterns into piano rolls.
+'''
+class MIDItoFVTest(unittest.TestCase):
+
+    def setUp(self):
+        self.midiUtil = nn_midi.NNMidiUtility()
+        self.rng = num.random.default_rng(0)
+
+    def Parse(self, pattern, name="song.mid"):
+        fakeMidi.files[name] = pattern
+        return self.midiUtil.MIDItoFV(name)
+
+    def AssertMatchesReference(self, pattern):
+        self.assertEqual(self.Parse(pattern), ReferenceMIDItoFV(self.midiUtil, pattern))
+
+    def testSimpleSong(self):
+        #Resolution 480: frames are sampled at ticks 60, 180, 300...
+        low = self.midiUtil.lowBound
+        pattern = Pattern([Track([NoteOnEvent(tick=0, pitch=low, velocity=80),
+                                  NoteOnEvent(tick=120, pitch=low + 2, velocity=80),
+                                  NoteOffEvent(tick=240, pitch=low),
+                                  EndOfTrackEvent(tick=1)])], resolution=480)
+        fv = num.array(self.Parse(pattern))
+        span = self.midiUtil.notespan
+
+        self.assertEqual(fv.shape, (4, 2 * span))
+        num.testing.assert_array_equal(num.flatnonzero(fv[0]), [0, span])
+        num.testing.assert_array_equal(num.flatnonzero(fv[1]), [0, 2, span + 2])
+        num.testing.assert_array_equal(num.flatnonzero(fv[2]), [0, 2])
+        num.testing.assert_array_equal(num.flatnonzero(fv[3]), [2])
+        self.assertEqual(fv.tolist(), ReferenceMIDItoFV(self.midiUtil, pattern))
+
+    def testTiesAtTheSameTick(self):
+        #Press and release of one note on the same tick, within a track and across tracks - order decides.
+        low = self.midiUtil.lowBound
+        pattern = Pattern([Track([NoteOnEvent(tick=60, pitch=low, velocity=80),
+                                  NoteOffEvent(tick=0, pitch=low),
+                                  NoteOnEvent(tick=60, pitch=low + 1, velocity=80),
+                                  EndOfTrackEvent(tick=1)]),
+                           Track([NoteOnEvent(tick=60, pitch=low + 3, velocity=80),
+                                  NoteOffEvent(tick=60, pitch=low + 1),
+                                  EndOfTrackEvent(tick=1)])], resolution=480)
+        fv = num.array(self.Parse(pattern))
+        span = self.midiUtil.notespan
+
+        #The frame sampled at tick 60 is taken before that tick's events. After that, low is pressed and released
+        #(track 0), low + 3 pressed (track 1), then low + 1 pressed (track 0) and released (track 1) at tick 120.
+        self.assertEqual(fv.shape, (2, 2 * span))
+        self.assertEqual(fv[0].sum(), 0)
+        num.testing.assert_array_equal(num.flatnonzero(fv[1]), [3, span + 3])
+        self.assertEqual(fv.tolist(), ReferenceMIDItoFV(self.midiUtil, pattern))
+
+    def testRandomMultiTrack(self):
+        for resolution in (480, 96, 384):
+            for i in range(10):
+                self.AssertMatchesReference(RandomPattern(self.rng, resolution))
+
+    def testTimeSignatureCutoff(self):
+        #Same notes each time, with a time signature change partway through the second track.
+        full = self.Parse(RandomPattern(num.random.default_rng(5), 480))
+
+        for numerator in (3, 6, 2):
+            pattern = RandomPattern(num.random.default_rng(5), 480, timeSignature=numerator)
+            fv = self.Parse(pattern)
+
+            self.assertEqual(fv, ReferenceMIDItoFV(self.midiUtil, pattern))
+
+            #Anything but 2 or 4 beats to the bar stops parsing there.
+            if numerator == 2:
+                self.assertEqual(fv, full)
+            else:
+                self.assertLess(len(fv), len(full))
+
+    def testResolutionNotDivisibleBy8(self):
+        #No tick ever lands on a sixteenth-plus-a-thirty-second, so all we get is the opening frame.
+        for resolution in (100, 220, 30):
+            pattern = RandomPattern(self.rng, resolution)
+            fv = self.Parse(pattern)
+
+            self.assertEqual(len(fv), 1)
+            self.assertEqual(fv, ReferenceMIDItoFV(self.midiUtil, pattern))
+
+    def testMaxLengthTruncation(self):
+        for maxLength in (1, 4, 17):
+            self.midiUtil.maxLength = maxLength
+
+            for i in range(5):
+                pattern = RandomPattern(self.rng, 96, numEvents=120)
+                fv = self.Parse(pattern)
+
+                self.assertEqual(len(fv), maxLength + 1)
+                self.assertEqual(fv, ReferenceMIDItoFV(self.midiUtil, pattern))
+
+'''
+FVtoMIDITest class.
+Writing piano rolls back out as note events.
+'''
+class FVtoMIDITest(unittest.TestCase):
+
+    def setUp(self):
+        self.midiUtil = nn_midi.NNMidiUtility()
+        self.rng = num.random.default_rng(1)
+
+    #Random piano roll where every note that starts is articulated, and some held notes are re-articulated.
+    def RandomRoll(self, frames):
+        span = self.midiUtil.notespan
+        held = (self.rng.random((frames, span)) < 0.3).astype(int)
+        starts = held & ~num.vstack((num.zeros((1, span), int), held[:-1])).astype(bool)
+        articulated = starts | (held & (self.rng.random((frames, span)) < 0.2))
+        return num.hstack((held, articulated))
+
+    def Write(self, fv):
+        self.midiUtil.FVtoMIDI(fv, "out", verbose=False)
+        return fakeMidi.files["out.midi"]
+
+    def Events(self, pattern):
+        track = pattern[0]
+        self.assertIsInstance(track[-1], EndOfTrackEvent)
+
+        return [("on" if isinstance(e, NoteOnEvent) else "off", e.tick, e.pitch) for e in track[:-1]]
+
+    def testMatchesReference(self):
+        for frames in (1, 2, 16, 100):
+            fv = self.RandomRoll(frames)
+            self.assertEqual(self.Events(self.Write(fv)), ReferenceFVtoMIDI(self.midiUtil, fv))
+
+    def testClosingRelease(self):
+        #A note held through the last frame is released one frame later.
+        fv = num.zeros((3, 2 * self.midiUtil.notespan), int)
+        fv[:, 5] = 1
+        fv[0, self.midiUtil.notespan + 5] = 1
+
+        pitch = self.midiUtil.lowBound + 5
+        self.assertEqual(self.Events(self.Write(fv)), [("on", 0, pitch), ("off", 3 * self.midiUtil.tickScale, pitch)])
+
+    def testRearticulation(self):
+        #A held note that's articulated again is pressed again, without being released in between.
+        fv = num.zeros((2, 2 * self.midiUtil.notespan), int)
+        fv[:, 0] = 1
+        fv[:, self.midiUtil.notespan] = 1
+
+        pitch = self.midiUtil.lowBound
+        tickScale = self.midiUtil.tickScale
+        self.assertEqual(self.Events(self.Write(fv)),
+                         [("on", 0, pitch), ("on", tickScale, pitch), ("off", tickScale, pitch)])
+
+    def testRoundTrip(self):
+        #At a resolution of 4 ticks per frame, parsing what we wrote gives the roll back, then the closing silence.
+        fv = self.RandomRoll(50)
+        pattern = self.Write(fv)
+        pattern.resolution = 4 * self.midiUtil.tickScale
+        fakeMidi.files["roundtrip.mid"] = pattern
+
+        parsed = num.array(self.midiUtil.MIDItoFV("roundtrip.mid"))
+
+        num.testing.assert_array_equal(parsed[:-1], fv)
+        self.assertEqual(parsed[-1].sum(), 0)
+
+    def testSilentSamplesSkipped(self):
+        samples = num.zeros((3, 4, 2 * self.midiUtil.notespan), num.uint8)
+        samples[1, 0, 0] = 1
+        fakeMidi.files.clear()
+
+        self.assertEqual(nn_midi.WriteSampleChunk(self.midiUtil, samples, "batch", 10), 1)
+        self.assertEqual(list(fakeMidi.files), ["batch/OutputSample-11.midi"])
+
+if __name__ == '__main__':
+    unittest.main()